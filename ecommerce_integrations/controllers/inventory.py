@@ -1,10 +1,15 @@
+import json
+from collections.abc import Iterator
+
 import frappe
 from frappe import _dict
-from frappe.query_builder import DocType
+from frappe.query_builder import Case, DocType, Order
 from frappe.query_builder.functions import Max, Sum
-from frappe.utils import now
+from frappe.utils import create_batch, now
 from frappe.utils.nestedset import get_descendants_of
 
+WAREHOUSE_DESCENDANTS_CACHE_KEY = "ecommerce_integrations_descendant_warehouses"
+
 
 def get_inventory_levels(warehouses: tuple[str], integration: str) -> list[_dict]:
 	"""
@@ -14,12 +19,86 @@ def get_inventory_levels(warehouses: tuple[str], integration: str) -> list[_dict
 	so ensure that if you sync the inventory with integration, you have also
 	updated `inventory_synced_on` field in related Ecommerce Item.
 
-	returns: list of _dict containing ecom_item, item_code, integration_item_code, variant_id, actual_qty, warehouse, reserved_qty
+	returns: list of _dict containing ecom_item, item_code, integration_item_code, variant_id, inventory_item_id, last_synced_inventory, actual_qty, warehouse, reserved_qty
 	"""
 	EcommerceItem = DocType("Ecommerce Item")
 	Bin = DocType("Bin")
 
-	query = (
+	query = _get_inventory_levels_query(integration).where(
+		(Bin.warehouse.isin(warehouses)) & (Bin.modified > EcommerceItem.inventory_synced_on)
+	)
+
+	return query.run(as_dict=1)
+
+
+def iter_inventory_levels(
+	warehouses: tuple[str], integration: str, page_size: int = 1000
+) -> Iterator[list[_dict]]:
+	"""Same as `get_inventory_levels` but yields pages of inventory levels instead of loading all rows at once.
+
+	Pages are formed by keyset pagination on Ecommerce Item, every page has all pending bins of its
+	items. Syncing a page updates `inventory_synced_on` of only its own items, so items of following
+	pages are still returned.
+	"""
+	EcommerceItem = DocType("Ecommerce Item")
+	Bin = DocType("Bin")
+
+	pending = (EcommerceItem.integration == integration) & (Bin.warehouse.isin(warehouses))
+	pending &= Bin.modified > EcommerceItem.inventory_synced_on
+
+	last_item = ""
+	while True:
+		ecom_items = [
+			d[0]
+			for d in (
+				frappe.qb.from_(EcommerceItem)
+				.join(Bin)
+				.on(EcommerceItem.erpnext_item_code == Bin.item_code)
+				.select(EcommerceItem.name)
+				.distinct()
+				.where(pending & (EcommerceItem.name > last_item))
+				.orderby(EcommerceItem.name, order=Order.asc)
+				.limit(page_size)
+			).run()
+		]
+		if not ecom_items:
+			return
+
+		query = _get_inventory_levels_query(integration).where(pending & EcommerceItem.name.isin(ecom_items))
+		if page := query.run(as_dict=1):
+			yield page
+
+		last_item = ecom_items[-1]
+
+
+def get_inventory_levels_of_bins(bins: list[tuple[str, str]], integration: str) -> list[_dict]:
+	"""Get inventory levels of specified (item_code, warehouse) pairs irrespective of when they were last synced.
+
+	This is useful when changed bins are already known, e.g. tracked using document events.
+	returns: same as `get_inventory_levels`
+	"""
+	Bin = DocType("Bin")
+
+	inventory_levels = []
+	for bins_batch in create_batch(list(set(bins)), 500):
+		bins_batch = set(bins_batch)
+		item_codes = {item_code for item_code, _ in bins_batch}
+		warehouses = {warehouse for _, warehouse in bins_batch}
+
+		query = _get_inventory_levels_query(integration).where(
+			(Bin.item_code.isin(item_codes)) & (Bin.warehouse.isin(warehouses))
+		)
+
+		inventory_levels.extend(d for d in query.run(as_dict=1) if (d.item_code, d.warehouse) in bins_batch)
+
+	return inventory_levels
+
+
+def _get_inventory_levels_query(integration: str):
+	EcommerceItem = DocType("Ecommerce Item")
+	Bin = DocType("Bin")
+
+	return (
 		frappe.qb.from_(EcommerceItem)
 		.join(Bin)
 		.on(EcommerceItem.erpnext_item_code == Bin.item_code)
@@ -28,19 +107,15 @@ def get_inventory_levels(warehouses: tuple[str], integration: str) -> list[_dict
 			Bin.item_code.as_("item_code"),
 			EcommerceItem.integration_item_code,
 			EcommerceItem.variant_id,
+			EcommerceItem.inventory_item_id,
+			EcommerceItem.last_synced_inventory,
 			Bin.actual_qty,
 			Bin.warehouse,
 			Bin.reserved_qty,
 		)
-		.where(
-			(Bin.warehouse.isin(warehouses))
-			& (Bin.modified > EcommerceItem.inventory_synced_on)
-			& (EcommerceItem.integration == integration)
-		)
+		.where(EcommerceItem.integration == integration)
 	)
 
-	return query.run(as_dict=1)
-
 
 def get_inventory_levels_of_group_warehouse(warehouse: str, integration: str):
 	"""Get updated inventory for a single group warehouse.
@@ -48,46 +123,125 @@ def get_inventory_levels_of_group_warehouse(warehouse: str, integration: str):
 	If warehouse mapping is done to a group warehouse then consolidation of all
 	leaf warehouses is required"""
 
-	child_warehouse = get_descendants_of("Warehouse", warehouse)
-	all_warehouses = (*tuple(child_warehouse), warehouse)
+	return get_inventory_levels_of_group_warehouses((warehouse,), integration)
+
+
+def get_inventory_levels_of_group_warehouses(
+	warehouses: tuple[str], integration: str, item_codes: list[str] | None = None
+) -> list[_dict]:
+	"""Get updated inventory for group warehouses, consolidated from all of their leaf warehouses.
+
+	All groups are resolved in a single query by joining Bins with lft/rgt range of the group warehouse.
+	If item_codes are specified then inventory of those items is returned irrespective of last sync time.
 
+	returns: same as `get_inventory_levels` with warehouse set to group warehouse.
+	"""
 	EcommerceItem = DocType("Ecommerce Item")
 	Bin = DocType("Bin")
+	Warehouse = DocType("Warehouse").as_("leaf_warehouse")
+	GroupWarehouse = DocType("Warehouse").as_("group_warehouse")
 
 	query = (
 		frappe.qb.from_(EcommerceItem)
 		.join(Bin)
 		.on(EcommerceItem.erpnext_item_code == Bin.item_code)
+		.join(Warehouse)
+		.on(Warehouse.name == Bin.warehouse)
+		.join(GroupWarehouse)
+		.on((Warehouse.lft >= GroupWarehouse.lft) & (Warehouse.rgt <= GroupWarehouse.rgt))
 		.select(
 			EcommerceItem.name.as_("ecom_item"),
-			Bin.item_code.as_("item_code"),
+			EcommerceItem.erpnext_item_code.as_("item_code"),
 			EcommerceItem.integration_item_code,
 			EcommerceItem.variant_id,
+			EcommerceItem.inventory_item_id,
+			EcommerceItem.last_synced_inventory,
+			GroupWarehouse.name.as_("warehouse"),
 			Sum(Bin.actual_qty).as_("actual_qty"),
 			Sum(Bin.reserved_qty).as_("reserved_qty"),
 			Max(Bin.modified).as_("last_updated"),
 			Max(EcommerceItem.inventory_synced_on).as_("last_synced"),
 		)
-		.where((Bin.warehouse.isin(all_warehouses)) & (EcommerceItem.integration == integration))
-		.groupby(EcommerceItem.erpnext_item_code)
-		.having(Max(Bin.modified) > Max(EcommerceItem.inventory_synced_on))
+		.where((GroupWarehouse.name.isin(warehouses)) & (EcommerceItem.integration == integration))
+		.groupby(EcommerceItem.name, GroupWarehouse.name)
 	)
 
-	data = query.run(as_dict=1)
+	if item_codes:
+		query = query.where(EcommerceItem.erpnext_item_code.isin(item_codes))
+	else:
+		query = query.having(Max(Bin.modified) > Max(EcommerceItem.inventory_synced_on))
 
-	# add warehouse as group warehouse for sending to integrations
-	for item in data:
-		item.warehouse = warehouse
+	return query.run(as_dict=1)
 
-	return data
 
+def get_descendant_warehouses(warehouse: str) -> list[str]:
+	"""Get all descendants of a group warehouse.
 
-def update_inventory_sync_status(ecommerce_item, time=None):
+	Cached till any change in warehouse tree, see `clear_descendant_warehouses_cache`."""
+	return frappe.cache().hget(
+		WAREHOUSE_DESCENDANTS_CACHE_KEY,
+		warehouse,
+		generator=lambda: get_descendants_of("Warehouse", warehouse, ignore_permissions=True),
+	)
+
+
+def clear_descendant_warehouses_cache(doc=None, method=None, *args, **kwargs):
+	"""Called by Warehouse document events when warehouse tree might change."""
+	frappe.cache().delete_value(WAREHOUSE_DESCENDANTS_CACHE_KEY)
+
+
+def update_inventory_sync_status(ecommerce_item: str | list[str], time=None) -> None:
 	"""Update `inventory_synced_on` timestamp to specified time or current time (if not specified).
 
 	After updating inventory levels to any integration, the Ecommerce Item should know about when it was last updated.
+	Pass list of ecommerce items to update all of them in a single query.
 	"""
 	if time is None:
 		time = now()
 
+	if isinstance(ecommerce_item, list | tuple | set):
+		if not ecommerce_item:
+			return
+		ecommerce_item = {"name": ("in", list(set(ecommerce_item)))}
+
 	frappe.db.set_value("Ecommerce Item", ecommerce_item, "inventory_synced_on", time)
+
+
+def get_last_synced_qty(inventory_level: _dict, location: str) -> float | None:
+	"""Get quantity last pushed to integration location for an inventory level returned by `get_inventory_levels`.
+
+	Returns None if quantity was never pushed to the location."""
+	last_synced_inventory = frappe.parse_json(inventory_level.last_synced_inventory or "{}")
+	return last_synced_inventory.get(str(location))
+
+
+def update_last_synced_inventory(synced_qty: dict[str, dict[str, float]]) -> None:
+	"""Record quantity pushed to integration locations.
+
+	synced_qty: {ecommerce_item: {location: qty}}
+	Quantities of locations not present in synced_qty are kept as is."""
+	if not synced_qty:
+		return
+
+	EcommerceItem = DocType("Ecommerce Item")
+	current_inventory = dict(
+		frappe.qb.from_(EcommerceItem)
+		.select(EcommerceItem.name, EcommerceItem.last_synced_inventory)
+		.where(EcommerceItem.name.isin(list(synced_qty)))
+		.run()
+	)
+
+	# merged in python and written back in a single query
+	last_synced_inventory = Case()
+	for ecommerce_item, location_qty in synced_qty.items():
+		inventory = frappe.parse_json(current_inventory.get(ecommerce_item) or "{}")
+		inventory.update({str(location): qty for location, qty in location_qty.items()})
+		last_synced_inventory = last_synced_inventory.when(
+			EcommerceItem.name == ecommerce_item, json.dumps(inventory)
+		)
+
+	(
+		frappe.qb.update(EcommerceItem)
+		.set(EcommerceItem.last_synced_inventory, last_synced_inventory)
+		.where(EcommerceItem.name.isin(list(synced_qty)))
+	).run()
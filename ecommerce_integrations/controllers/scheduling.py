@@ -1,6 +1,30 @@
+import functools
+import json
+import os
+import socket
+import threading
+
 import frappe
 from frappe.utils import add_to_date, cint, get_datetime, now
 
+LEASE_KEY_PREFIX = "ecommerce_integrations_lease"
+LEASE_TTL = 120  # seconds
+
+# lease is only extended or released by the worker holding it
+_EXTEND_LEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+	return redis.call("expire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_RELEASE_LEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+	return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
 
 def need_to_run(setting, interval_field, timestamp_field) -> bool:
 	"""A utility function to make "configurable" scheduled events.
@@ -21,3 +45,88 @@ def need_to_run(setting, interval_field, timestamp_field) -> bool:
 
 	frappe.db.set_value(setting, None, timestamp_field, now(), update_modified=False)
 	return True
+
+
+def single_instance(lease_name: str, ttl: int = LEASE_TTL):
+	"""Decorator to ensure that only one instance of a job runs at a time across all workers.
+
+	If another worker holds the lease, the decorated function returns without running.
+	Lease is kept alive by a heartbeat while the function runs and expires automatically
+	after `ttl` seconds if the worker holding it dies.
+	"""
+
+	def decorator(func):
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			lease = JobLease(lease_name, ttl=ttl)
+			if not lease.acquire():
+				return
+
+			try:
+				return func(*args, **kwargs)
+			finally:
+				lease.release()
+
+		return wrapper
+
+	return decorator
+
+
+class JobLease:
+	"""Redis backed lease with heartbeat."""
+
+	def __init__(self, name: str, ttl: int = LEASE_TTL):
+		self.name = name
+		self.ttl = ttl
+
+		self._cache = frappe.cache()
+		self._key = get_lease_key(name)
+		self._value = json.dumps(
+			{
+				"owner": f"{socket.gethostname()}:{os.getpid()}",
+				"acquired_at": now(),
+				"token": frappe.generate_hash(length=16),
+			}
+		)
+		self._stop_heartbeat = threading.Event()
+		self._heartbeat_thread = None
+
+	def acquire(self) -> bool:
+		if not self._cache.set(self._key, self._value, nx=True, ex=self.ttl):
+			return False
+
+		self._heartbeat_thread = threading.Thread(target=self._heartbeat, daemon=True)
+		self._heartbeat_thread.start()
+		return True
+
+	def release(self) -> None:
+		self._stop_heartbeat.set()
+		if self._heartbeat_thread:
+			self._heartbeat_thread.join()
+
+		self._cache.eval(_RELEASE_LEASE_SCRIPT, 1, self._key, self._value)
+
+	def _heartbeat(self) -> None:
+		# runs in separate thread, only uses redis connection and no site context.
+		while not self._stop_heartbeat.wait(self.ttl / 3):
+			if not self._cache.eval(_EXTEND_LEASE_SCRIPT, 1, self._key, self._value, self.ttl):
+				return  # lease expired and possibly taken by another worker
+
+
+def get_lease(name: str) -> dict | None:
+	"""Get details of lease if it's currently held, used for showing running jobs."""
+	cache = frappe.cache()
+	key = get_lease_key(name)
+
+	value = cache.get(key)
+	if not value:
+		return
+
+	lease = json.loads(frappe.safe_decode(value))
+	lease.pop("token", None)
+	lease["expires_in"] = cache.ttl(key)
+	return lease
+
+
+def get_lease_key(name: str) -> str:
+	return frappe.cache().make_key(f"{LEASE_KEY_PREFIX}:{name}")
@@ -0,0 +1,96 @@
+# Copyright (c) 2021, Frappe and Contributors
+# See LICENSE
+
+import unittest
+
+import frappe
+from erpnext.stock.utils import get_or_make_bin
+from frappe.utils import add_days, now
+
+from ecommerce_integrations.controllers.inventory import (
+	get_descendant_warehouses,
+	iter_inventory_levels,
+	update_inventory_sync_status,
+	update_last_synced_inventory,
+)
+
+
+class TestInventory(unittest.TestCase):
+	def test_descendant_warehouses_after_rename(self):
+		group = _make_warehouse("_Test Ecommerce Group Warehouse", is_group=1)
+		child = _make_warehouse("_Test Ecommerce Child Warehouse", parent_warehouse=group)
+		self.assertEqual(get_descendant_warehouses(group), [child])
+
+		renamed = frappe.rename_doc("Warehouse", child, child.replace("Child", "Renamed Child"), force=True)
+		self.assertEqual(get_descendant_warehouses(group), [renamed])
+
+		frappe.delete_doc("Warehouse", renamed)
+		frappe.delete_doc("Warehouse", group)
+
+	def test_synced_pages_dont_hide_other_warehouses(self):
+		warehouses = ("_Test Warehouse - _TC", "_Test Warehouse 1 - _TC")
+		for warehouse in warehouses:
+			get_or_make_bin("_Test Item", warehouse)
+
+		ecom_item = frappe.get_doc(
+			{
+				"doctype": "Ecommerce Item",
+				"integration": "shopify",
+				"integration_item_code": "_TEST_INVENTORY_ITEM",
+				"erpnext_item_code": "_Test Item",
+				"inventory_synced_on": add_days(now(), -1),
+			}
+		).insert()
+		frappe.db.set_value("Bin", {"item_code": "_Test Item"}, "modified", now())
+
+		synced_warehouses = []
+		for page in iter_inventory_levels(warehouses, "shopify", page_size=1):
+			synced_warehouses.extend(d.warehouse for d in page if d.ecom_item == ecom_item.name)
+			# syncing first page updates sync time of item before second page is read
+			update_inventory_sync_status(ecom_item.name)
+
+		self.assertEqual(sorted(synced_warehouses), sorted(warehouses))
+		ecom_item.delete()
+
+	def test_update_last_synced_inventory(self):
+		ecom_items = [
+			frappe.get_doc(
+				{
+					"doctype": "Ecommerce Item",
+					"integration": "shopify",
+					"integration_item_code": f"_TEST_SYNCED_ITEM_{i}",
+					"erpnext_item_code": "_Test Item",
+					"last_synced_inventory": '{"1": 5}',
+				}
+			).insert()
+			for i in range(2)
+		]
+
+		update_last_synced_inventory({ecom_items[0].name: {2: 3}, ecom_items[1].name: {1: 0}})
+
+		# quantities of other locations are kept
+		self.assertEqual(
+			[
+				frappe.parse_json(frappe.db.get_value(d.doctype, d.name, "last_synced_inventory"))
+				for d in ecom_items
+			],
+			[{"1": 5, "2": 3}, {"1": 0}],
+		)
+		for d in ecom_items:
+			d.delete()
+
+
+def _make_warehouse(warehouse_name, is_group=0, parent_warehouse=None) -> str:
+	return (
+		frappe.get_doc(
+			{
+				"doctype": "Warehouse",
+				"warehouse_name": warehouse_name,
+				"company": "_Test Company",
+				"is_group": is_group,
+				"parent_warehouse": parent_warehouse,
+			}
+		)
+		.insert(ignore_if_duplicate=True)
+		.name
+	)
@@ -1,12 +1,17 @@
 # Copyright (c) 2021, Frappe and contributors
 # For license information, please see LICENSE
 
+from collections.abc import Iterable
+
 import frappe
 from erpnext import get_default_company
 from frappe import _
 from frappe.model.document import Document
+from frappe.query_builder import Criterion, Order
 from frappe.utils import cstr, get_datetime, now
 
+INVENTORY_ITEM_ID_CACHE_KEY = "ecommerce_item_inventory_item_id"
+
 
 class EcommerceItem(Document):
 	erpnext_item_code: str  # item_code in ERPNext
@@ -16,10 +21,18 @@ class EcommerceItem(Document):
 	has_variants: int  # is the product a template, i.e. does it have varients
 	variant_of: str  # template id of ERPNext item
 	sku: str  # SKU
+	inventory_item_id: str  # unique id of inventory item of variant on integration
 
 	def validate(self):
 		self.set_defaults()
 
+	def on_update(self):
+		if self.has_value_changed("inventory_item_id"):
+			frappe.cache().hdel(INVENTORY_ITEM_ID_CACHE_KEY, self.name)
+
+	def on_trash(self):
+		frappe.cache().hdel(INVENTORY_ITEM_ID_CACHE_KEY, self.name)
+
 	def before_insert(self):
 		self.check_unique_constraints()
 
@@ -51,6 +64,12 @@ class EcommerceItem(Document):
 			self.inventory_synced_on = get_datetime("1970-01-01")
 
 
+def on_doctype_update():
+	# used by inventory sync for finding bins modified after last sync
+	frappe.db.add_index("Ecommerce Item", ["integration", "erpnext_item_code", "inventory_synced_on"])
+	frappe.db.add_index("Bin", ["item_code", "warehouse", "modified"])
+
+
 def is_synced(
 	integration: str,
 	integration_item_code: str,
@@ -122,6 +141,61 @@ def get_erpnext_item(
 		return frappe.get_doc("Item", item_code)
 
 
+def get_erpnext_item_codes(
+	integration: str, items: Iterable[tuple[str, str | None, str | None]]
+) -> dict[tuple[str, str, str], str]:
+	"""Bulk version of `get_erpnext_item` which uses a single query for all items.
+
+	items: (integration_item_code, variant_id, sku) of each item.
+	Returns item code of each item that was found, keyed by same tuple with all values as string.
+	"""
+	items = {tuple(cstr(value) for value in item) for item in items}
+
+	integration_item_codes = {item[0] for item in items if item[0]}
+	skus = {item[2] for item in items if item[2]}
+	if not integration_item_codes and not skus:
+		return {}
+
+	ecom_item = frappe.qb.DocType("Ecommerce Item")
+	conditions = []
+	if integration_item_codes:
+		conditions.append(ecom_item.integration_item_code.isin(list(integration_item_codes)))
+	if skus:
+		conditions.append(ecom_item.sku.isin(list(skus)))
+
+	ecommerce_items = (
+		frappe.qb.from_(ecom_item)
+		.select(
+			ecom_item.erpnext_item_code, ecom_item.integration_item_code, ecom_item.variant_id, ecom_item.sku
+		)
+		.where((ecom_item.integration == integration) & Criterion.any(conditions))
+		.orderby(ecom_item.modified, order=Order.desc)  # same as default ordering of get_value
+	).run(as_dict=True)
+
+	sku_map, variant_map, product_map = {}, {}, {}
+	for d in ecommerce_items:
+		if d.sku:
+			sku_map.setdefault(d.sku, d.erpnext_item_code)
+		variant_map.setdefault((d.integration_item_code, d.variant_id), d.erpnext_item_code)
+		product_map.setdefault(d.integration_item_code, d.erpnext_item_code)
+
+	item_codes = {}
+	for item in items:
+		integration_item_code, variant_id, sku = item
+
+		# same precedence as `get_erpnext_item`: SKU first, then product and variant ids
+		item_code = sku_map.get(sku) if sku else None
+		if not item_code and variant_id:
+			item_code = variant_map.get((integration_item_code, variant_id))
+		elif not item_code:
+			item_code = product_map.get(integration_item_code)
+
+		if item_code:
+			item_codes[item] = item_code
+
+	return item_codes
+
+
 def create_ecommerce_item(
 	integration: str,
 	integration_item_code: str,
@@ -130,6 +204,7 @@ def create_ecommerce_item(
 	sku: str | None = None,
 	variant_of: str | None = None,
 	has_variants=0,
+	inventory_item_id: str | None = None,
 ) -> None:
 	"""Create Item in erpnext and link it with Ecommerce item doctype.
 
@@ -166,8 +241,31 @@ def create_ecommerce_item(
 			"variant_id": cstr(variant_id),
 			"variant_of": cstr(variant_of),
 			"sku": sku,
+			"inventory_item_id": cstr(inventory_item_id),
 			"item_synced_on": now(),
 		}
 	)
 
 	ecommerce_item.insert()
+
+
+def get_inventory_item_id(ecommerce_item: str) -> str | None:
+	"""Get inventory item id of ecommerce item.
+
+	Inventory item id never changes for a variant, so it's cached in a shared cache across workers."""
+
+	return frappe.cache().hget(
+		INVENTORY_ITEM_ID_CACHE_KEY,
+		ecommerce_item,
+		generator=lambda: frappe.db.get_value("Ecommerce Item", ecommerce_item, "inventory_item_id"),
+	)
+
+
+def set_inventory_item_id(ecommerce_item: str, inventory_item_id: str) -> None:
+	"""Store inventory item id fetched from integration for ecommerce items synced before it was tracked."""
+
+	inventory_item_id = cstr(inventory_item_id)
+	frappe.db.set_value(
+		"Ecommerce Item", ecommerce_item, "inventory_item_id", inventory_item_id, update_modified=False
+	)
+	frappe.cache().hset(INVENTORY_ITEM_ID_CACHE_KEY, ecommerce_item, inventory_item_id)
@@ -64,6 +64,35 @@ class TestEcommerceItem(unittest.TestCase):
 		self.assertEqual(a.name, b.name)
 		self.assertEqual(a.item_code, b.item_code)
 
+	def test_get_erpnext_item_codes(self):
+		self._create_variant_doc()
+		self._create_doc_with_sku()
+
+		items = [
+			("T-SHIRT", "T-SHIRT-RED", None),
+			("T-SHIRT", None, "TEST_ITEM_1"),
+			("T-SHIRT", "Unknown variant", None),
+		]
+		item_codes = ecommerce_item.get_erpnext_item_codes("shopify", items)
+
+		self.assertEqual(item_codes[("T-SHIRT", "T-SHIRT-RED", "")], "_Test Item 2")
+		self.assertEqual(item_codes[("T-SHIRT", "", "TEST_ITEM_1")], "_Test Item")
+		self.assertNotIn(("T-SHIRT", "Unknown variant", ""), item_codes)
+
+		for integration_item_code, variant_id, sku in items:
+			item = ecommerce_item.get_erpnext_item("shopify", integration_item_code, variant_id, sku)
+			key = (integration_item_code, variant_id or "", sku or "")
+			self.assertEqual(item_codes.get(key), item.item_code if item else None)
+
+	def test_inventory_item_id_backfill(self):
+		self._create_variant_doc()
+		name = frappe.db.get_value("Ecommerce Item", {"variant_id": "T-SHIRT-RED"})
+		self.assertFalse(ecommerce_item.get_inventory_item_id(name))
+
+		ecommerce_item.set_inventory_item_id(name, 42)
+		self.assertEqual(ecommerce_item.get_inventory_item_id(name), "42")
+		self.assertEqual(frappe.db.get_value("Ecommerce Item", name, "inventory_item_id"), "42")
+
 	def _create_doc(self):
 		"""basic test for creation of ecommerce item"""
 		frappe.get_doc(
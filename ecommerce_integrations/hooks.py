@@ -128,6 +128,16 @@ doc_events = {
 	# 	"on_cancel": "ecommerce_integrations.unicommerce.grn.prevent_grn_cancel",
 	# },
 	"Item Price": {"on_change": "ecommerce_integrations.utils.price_list.discard_item_prices"},
+	"Bin": {"on_update": "ecommerce_integrations.shopify.inventory.mark_bin_as_changed"},
+	"Warehouse": {
+		"on_update": "ecommerce_integrations.controllers.inventory.clear_descendant_warehouses_cache",
+		"after_rename": "ecommerce_integrations.controllers.inventory.clear_descendant_warehouses_cache",
+		"on_trash": "ecommerce_integrations.controllers.inventory.clear_descendant_warehouses_cache",
+	},
+	"Stock Ledger Entry": {
+		"on_submit": "ecommerce_integrations.shopify.inventory.mark_bin_as_changed",
+		"on_cancel": "ecommerce_integrations.shopify.inventory.mark_bin_as_changed",
+	},
 	# "Pick List": {"validate": "ecommerce_integrations.unicommerce.pick_list.validate"},
 	# "Sales Invoice": {
 	# 	"on_submit": "ecommerce_integrations.unicommerce.invoice.on_submit",
@@ -139,7 +149,13 @@ doc_events = {
 # ---------------
 
 scheduler_events = {
-	"all": ["ecommerce_integrations.shopify.inventory.update_inventory_on_shopify"],
+	"all": [
+		"ecommerce_integrations.shopify.inventory.update_inventory_on_shopify",
+		"ecommerce_integrations.shopify.connection.process_webhook_buffer",
+		"ecommerce_integrations.shopify.order.sync_queued_orders",
+		"ecommerce_integrations.shopify.sequencing.process_pending_order_events",
+		"ecommerce_integrations.shopify.pipeline.enqueue_due_order_stages",
+	],
 	"daily": [],
 	"daily_long": [
 		# "ecommerce_integrations.zenoti.doctype.zenoti_settings.zenoti_settings.sync_stocks"
@@ -157,6 +173,9 @@ scheduler_events = {
 	"weekly": [],
 	"monthly": [],
 	"cron": {
+		"*/10 * * * *": [
+			"ecommerce_integrations.shopify.reconciliation.reconcile_orders",
+		],
 		# Every five minutes
 		# "*/5 * * * *": [
 		# 	"ecommerce_integrations.unicommerce.order.sync_new_orders",
@@ -0,0 +1,60 @@
+import frappe
+
+from ecommerce_integrations.shopify.constants import (
+	FULLFILLMENT_ID_FIELD,
+	ORDER_ID_FIELD,
+	ORDER_NUMBER_FIELD,
+	ORDER_STATUS_FIELD,
+)
+
+ORDER_FIELDS = [ORDER_ID_FIELD, ORDER_NUMBER_FIELD, ORDER_STATUS_FIELD]
+
+FIELDS = {
+	"Sales Order": ORDER_FIELDS,
+	"Sales Invoice": ORDER_FIELDS,
+	"Delivery Note": [*ORDER_FIELDS, FULLFILLMENT_ID_FIELD],
+}
+
+INDEXED_FIELDS = (ORDER_ID_FIELD, ORDER_NUMBER_FIELD, FULLFILLMENT_ID_FIELD)
+
+
+def execute():
+	"""Convert shopify id fields from Small Text (TEXT) to indexed Data (varchar) fields.
+
+	Sales Order, Sales Invoice and Delivery Note tables are write-locked while they're converted."""
+
+	for doctype, fields in FIELDS.items():
+		fields = [field for field in fields if frappe.db.has_column(doctype, field)]
+		if not fields:
+			continue
+
+		if frappe.db.db_type == "mariadb":
+			_alter_table(doctype, fields)
+
+		for field in fields:
+			frappe.db.set_value(
+				"Custom Field",
+				{"dt": doctype, "fieldname": field},
+				{"fieldtype": "Data", "search_index": int(field in INDEXED_FIELDS)},
+			)
+
+		# no-op on mariadb where table is already altered
+		frappe.db.updatedb(doctype)
+		frappe.clear_cache(doctype=doctype)
+
+
+def _alter_table(doctype, fields):
+	"""Modify all columns and add indexes in one ALTER so that large tables are rebuilt only once.
+
+	TEXT to varchar conversion needs a copy of the table, which can't be done without locking writes.
+	Table is write-locked (readable) while it's rebuilt, run this patch in a maintenance window on
+	sites with large number of orders."""
+	table = f"tab{doctype}"
+
+	changes = [f"MODIFY `{field}` varchar(140)" for field in fields]
+	changes += [
+		f"ADD INDEX `{field}_index`(`{field}`)"
+		for field in fields
+		if field in INDEXED_FIELDS and not frappe.db.has_index(table, f"{field}_index")
+	]
+	frappe.db.sql_ddl(f"ALTER TABLE `{table}` {', '.join(changes)}, ALGORITHM=COPY, LOCK=SHARED")
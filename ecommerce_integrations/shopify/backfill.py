@@ -0,0 +1,197 @@
+"""Parallel sync of old orders.
+
+Time range of old orders is split in shards, each shard is synced by a separate job on long queue.
+Every shard checkpoints id of last synced order, a shard that was interrupted resumes from there
+when `sync_old_orders` runs next. State of all shards is kept in redis used for background jobs.
+"""
+
+import json
+from datetime import timedelta
+
+import frappe
+from frappe.utils import cint, get_datetime, now_datetime, time_diff_in_seconds
+from frappe.utils.background_jobs import get_redis_conn
+from shopify.resources import Order
+
+from ecommerce_integrations.controllers.scheduling import JobLease
+from ecommerce_integrations.shopify.connection import temp_shopify_session
+from ecommerce_integrations.shopify.constants import (
+	BACKFILL_KEY,
+	BACKFILL_SHARD_LEASE,
+	EVENT_MAPPER,
+	SETTING_DOCTYPE,
+)
+from ecommerce_integrations.shopify.utils import create_shopify_log
+
+DEFAULT_SHARDS = 4
+PROGRESS_EVENT = "shopify_old_orders_progress"
+PROGRESS_INTERVAL = 50  # orders
+
+
+def run_backfill(setting) -> None:
+	"""Start sync of old orders or resume shards that aren't running, called by `sync_old_orders`."""
+	shards = get_shards()
+	if not shards:
+		# shopify runs one bulk operation per shop at a time, parallel shards would only wait for each other
+		shard_count = (
+			1 if cint(setting.use_bulk_operations) else cint(setting.old_orders_sync_jobs) or DEFAULT_SHARDS
+		)
+		shards = _plan_shards(setting.old_orders_from, setting.old_orders_to, shard_count)
+
+	for shard_id, shard in shards.items():
+		if shard["status"] != "Completed":
+			frappe.enqueue(
+				sync_shard,
+				queue="long",
+				timeout=6 * 60 * 60,
+				job_id=f"{BACKFILL_KEY}:{shard_id}",
+				deduplicate=True,
+				shard_id=shard_id,
+			)
+
+	_finish_if_completed()
+
+
+@temp_shopify_session
+def sync_shard(shard_id: str) -> None:
+	# local import to avoid circular dependencies
+	from ecommerce_integrations.shopify.order import _fetch_old_orders, sync_sales_order
+
+	lease = JobLease(f"{BACKFILL_SHARD_LEASE}:{shard_id}")
+	if not lease.acquire():
+		return
+
+	try:
+		shard = _get_shard(shard_id)
+		if not shard or shard["status"] == "Completed":
+			return
+
+		shard["status"] = "Running"
+		shard["started_at"] = shard["started_at"] or str(now_datetime())
+		_save_shard(shard_id, shard)
+
+		for order in _fetch_old_orders(shard["from"], shard["to"], since_id=shard["cursor"]):
+			log = create_shopify_log(
+				method=EVENT_MAPPER["orders/create"], request_data=json.dumps(order), make_new=True
+			)
+			sync_sales_order(order, request_id=log.name)
+
+			shard["cursor"] = order["id"]
+			shard["synced"] += 1
+			if not _save_shard(shard_id, shard):
+				return  # sync was reset from setting
+
+			if shard["synced"] % PROGRESS_INTERVAL == 0:
+				publish_progress()
+
+		shard["status"] = "Completed"
+		_save_shard(shard_id, shard)
+	finally:
+		lease.release()
+
+	publish_progress()
+	_finish_if_completed()
+
+
+def get_progress() -> dict:
+	"""Get progress of old order sync, with speed in orders per second."""
+	shards = get_shards()
+	if not shards:
+		return {}
+
+	total = sum(shard["total"] for shard in shards.values())
+	synced = sum(shard["synced"] for shard in shards.values())
+
+	started_at = [shard["started_at"] for shard in shards.values() if shard["started_at"]]
+	elapsed = time_diff_in_seconds(now_datetime(), min(started_at)) if started_at else 0
+
+	return {
+		"total": total,
+		"synced": synced,
+		"percent": round(synced * 100 / total, 2) if total else 0,
+		"orders_per_second": round(synced / elapsed, 2) if elapsed else 0,
+		"shards": shards,
+	}
+
+
+def publish_progress() -> None:
+	frappe.publish_realtime(PROGRESS_EVENT, get_progress(), doctype=SETTING_DOCTYPE, docname=SETTING_DOCTYPE)
+
+
+def get_shards() -> dict[str, dict]:
+	return {
+		frappe.safe_decode(shard_id): json.loads(shard)
+		for shard_id, shard in get_redis_conn().hgetall(_get_backfill_key()).items()
+	}
+
+
+def clear_backfill() -> None:
+	get_redis_conn().delete(_get_backfill_key())
+
+
+def _plan_shards(from_time, to_time, count: int) -> dict[str, dict]:
+	from_time, to_time = get_datetime(from_time), get_datetime(to_time)
+	shard_size = (to_time - from_time) / count
+
+	# ranges are inclusive and created_at of orders has whole seconds, every shard ends a second
+	# before next one starts so that orders at the boundary are synced only once.
+	starts = [from_time] + [(from_time + shard_size * i).replace(microsecond=0) for i in range(1, count)]
+	ends = [start - timedelta(seconds=1) for start in starts[1:]] + [to_time]
+
+	shards = {}
+	for i, (shard_from, shard_to) in enumerate(zip(starts, ends, strict=True)):
+		shards[str(i)] = {
+			"from": str(shard_from),
+			"to": str(shard_to),
+			"total": _count_orders(shard_from, shard_to),
+			"synced": 0,
+			"cursor": 0,
+			"status": "Queued",
+			"started_at": None,
+		}
+
+	get_redis_conn().hset(
+		_get_backfill_key(), mapping={shard_id: json.dumps(shard) for shard_id, shard in shards.items()}
+	)
+	return shards
+
+
+def _count_orders(from_time, to_time) -> int:
+	return cint(
+		Order.count(
+			created_at_min=from_time.astimezone().isoformat(), created_at_max=to_time.astimezone().isoformat()
+		)
+	)
+
+
+def _get_shard(shard_id: str) -> dict | None:
+	shard = get_redis_conn().hget(_get_backfill_key(), shard_id)
+	return json.loads(shard) if shard else None
+
+
+def _save_shard(shard_id: str, shard: dict) -> bool:
+	"""Checkpoint shard, returns False if sync was reset in the meantime."""
+	redis = get_redis_conn()
+	key = _get_backfill_key()
+
+	if not redis.hexists(key, shard_id):
+		return False
+
+	redis.hset(key, shard_id, json.dumps(shard))
+	return True
+
+
+def _finish_if_completed() -> None:
+	shards = get_shards()
+	if not shards or any(shard["status"] != "Completed" for shard in shards.values()):
+		return
+
+	clear_backfill()
+	setting = frappe.get_doc(SETTING_DOCTYPE)
+	setting.sync_old_orders = 0
+	setting.save()
+
+
+def _get_backfill_key() -> str:
+	# job redis is shared by all sites on bench
+	return f"{frappe.local.site}:{BACKFILL_KEY}"
@@ -0,0 +1,463 @@
+"""Export of orders and products using GraphQL bulk operations.
+
+A bulk operation runs the query on Shopify's side, without pagination or rate limits, and writes the
+result to a JSONL file. Each line of the file is one node, nodes of nested connections are on separate
+lines after their parent and refer to it with `__parentId`. The file is read line by line and every
+record is yielded as soon as all its nodes are read.
+
+Bulk queries can't have connections inside list fields, line items of fulfillments of exported orders
+are fetched by a follow up query for a batch of orders at a time.
+
+Records are converted to the shape of REST resources, so they can be passed to `sync_sales_order`
+and `ShopifyProduct._make_item` like records fetched using REST API.
+"""
+
+import json
+import time
+import urllib.request
+from collections.abc import Iterator
+
+import frappe
+from frappe import _
+from frappe.utils import create_batch, flt, get_datetime
+
+from ecommerce_integrations.shopify.constants import SHOPIFY_VARIANTS_ATTR_LIST
+from ecommerce_integrations.shopify.graphql import execute_graphql, from_gid
+
+POLL_INTERVAL = 5  # seconds
+BUSY_POLL_INTERVAL = 30  # seconds, while bulk operation of another job is running
+BULK_OPERATION_TIMEOUT = 6 * 60 * 60
+DOWNLOAD_TIMEOUT = 60
+ORDER_BATCH_SIZE = 100
+FULFILLMENT_BATCH_SIZE = 50
+
+RUN_BULK_QUERY_MUTATION = """
+mutation ($query: String!) {
+	bulkOperationRunQuery(query: $query) {
+		bulkOperation {
+			id
+		}
+		userErrors {
+			field
+			message
+		}
+	}
+}
+"""
+
+BULK_OPERATION_QUERY = """
+query ($id: ID!) {
+	node(id: $id) {
+		... on BulkOperation {
+			id
+			status
+			errorCode
+			objectCount
+			url
+		}
+	}
+}
+"""
+
+_MONEY = "shopMoney { amount }"
+_TAX_LINES = f"taxLines {{ title rate priceSet {{ {_MONEY} }} }}"
+_DISCOUNT_ALLOCATIONS = f"discountAllocations {{ allocatedAmountSet {{ {_MONEY} }} }}"
+_ADDRESS = "name firstName lastName address1 address2 city province zip country phone"
+
+# bulk queries don't accept variables, filter is added to the query itself
+ORDERS_BULK_QUERY = f"""
+{{
+	orders(query: %s, sortKey: ID) {{
+		edges {{
+			node {{
+				id
+				name
+				createdAt
+				email
+				phone
+				note
+				taxesIncluded
+				displayFinancialStatus
+				customer {{ id firstName lastName email phone }}
+				shippingAddress {{ {_ADDRESS} }}
+				billingAddress {{ {_ADDRESS} }}
+				{_TAX_LINES}
+				fulfillments {{ id createdAt location {{ id }} }}
+				lineItems {{
+					edges {{
+						node {{
+							__typename
+							id
+							title
+							name
+							quantity
+							sku
+							product {{ id }}
+							variant {{ id }}
+							originalUnitPriceSet {{ {_MONEY} }}
+							{_TAX_LINES}
+							{_DISCOUNT_ALLOCATIONS}
+						}}
+					}}
+				}}
+				shippingLines {{
+					edges {{
+						node {{
+							__typename
+							id
+							title
+							originalPriceSet {{ {_MONEY} }}
+							discountedPriceSet {{ {_MONEY} }}
+							{_TAX_LINES}
+							{_DISCOUNT_ALLOCATIONS}
+						}}
+					}}
+				}}
+			}}
+		}}
+	}}
+}}
+"""
+
+FULFILLMENT_LINE_ITEMS_QUERY = """
+query ($ids: [ID!]!) {
+	nodes(ids: $ids) {
+		... on Fulfillment {
+			id
+			fulfillmentLineItems(first: 250) {
+				nodes {
+					id
+					quantity
+					lineItem { id sku product { id } variant { id } }
+				}
+			}
+		}
+	}
+}
+"""
+
+PRODUCTS_BULK_QUERY = """
+{
+	products {
+		edges {
+			node {
+				id
+				title
+				descriptionHtml
+				productType
+				vendor
+				options { name values }
+				featuredImage { url }
+				variants {
+					edges {
+						node {
+							__typename
+							id
+							title
+							sku
+							price
+							weight
+							weightUnit
+							inventoryItem { id }
+							selectedOptions { name value }
+						}
+					}
+				}
+			}
+		}
+	}
+}
+"""
+
+WEIGHT_UNITS = {"GRAMS": "g", "KILOGRAMS": "kg", "OUNCES": "oz", "POUNDS": "lb"}
+
+
+def export_orders(from_time, to_time, since_id=0) -> Iterator[dict]:
+	"""Export orders created in given time range, in the shape of REST `Order` resource.
+
+	Orders are exported in ascending order of id, `since_id` can be used to resume after last synced order.
+	Needs an active shopify session, i.e. call this from a function decorated with `temp_shopify_session`."""
+	search = (
+		f"created_at:>='{get_datetime(from_time).astimezone().isoformat()}'"
+		f" AND created_at:<='{get_datetime(to_time).astimezone().isoformat()}'"
+	)
+	if since_id:
+		search += f" AND id:>{since_id}"
+	url = run_bulk_query(ORDERS_BULK_QUERY % json.dumps(search))
+
+	orders = []
+	for order in iter_bulk_results(url):
+		orders.append(order)
+		if len(orders) == ORDER_BATCH_SIZE:
+			yield from _to_rest_orders(orders)
+			orders = []
+
+	yield from _to_rest_orders(orders)
+
+
+def export_products() -> Iterator[dict]:
+	"""Export all products, in the shape of REST `Product` resource.
+
+	Needs an active shopify session, i.e. call this from a function decorated with `temp_shopify_session`."""
+	url = run_bulk_query(PRODUCTS_BULK_QUERY)
+
+	for product in iter_bulk_results(url):
+		yield _to_rest_product(product)
+
+
+def run_bulk_query(query: str, timeout: int = BULK_OPERATION_TIMEOUT) -> str | None:
+	"""Start bulk operation for the query and wait till it completes.
+
+	Only one bulk query runs at a time for a shop, query is started after the running one (e.g. of
+	another import) is complete. Returns url of the result file, None if the query didn't return anything."""
+	deadline = time.monotonic() + timeout
+
+	while True:
+		response = execute_graphql(RUN_BULK_QUERY_MUTATION, {"query": query})["bulkOperationRunQuery"]
+		user_errors = response["userErrors"]
+		if not user_errors:
+			break
+
+		if _is_busy(user_errors) and time.monotonic() < deadline:
+			time.sleep(BUSY_POLL_INTERVAL)
+			continue
+
+		messages = ", ".join(e["message"] for e in user_errors)
+		frappe.throw(_("Shopify Bulk Operation Error: {0}").format(messages))
+
+	operation_id = response["bulkOperation"]["id"]
+
+	while True:
+		operation = execute_graphql(BULK_OPERATION_QUERY, {"id": operation_id})["node"]
+		if operation["status"] == "COMPLETED":
+			return operation.get("url")
+
+		if operation["status"] in ("FAILED", "CANCELED", "EXPIRED"):
+			frappe.throw(
+				_("Shopify Bulk Operation {0} is {1}: {2}").format(
+					operation_id, operation["status"].lower(), operation.get("errorCode")
+				)
+			)
+
+		if time.monotonic() > deadline:
+			frappe.throw(_("Shopify Bulk Operation {0} did not complete in time.").format(operation_id))
+
+		time.sleep(POLL_INTERVAL)
+
+
+def _is_busy(user_errors: list[dict]) -> bool:
+	return all("already in progress" in (e.get("message") or "") for e in user_errors)
+
+
+def iter_bulk_results(url: str | None) -> Iterator[dict]:
+	"""Read result file of bulk operation line by line and yield top level nodes.
+
+	Nodes of nested connections are collected in `__children` of their parent, grouped by `__typename`."""
+	if not url:
+		return
+
+	record = None
+	nodes = {}  # nodes of current record by id, to find parents of nested nodes
+
+	with urllib.request.urlopen(url, timeout=DOWNLOAD_TIMEOUT) as result_file:
+		for line in result_file:
+			if not line.strip():
+				continue
+
+			node = json.loads(line)
+			parent_id = node.pop("__parentId", None)
+
+			if parent_id:
+				children = nodes[parent_id].setdefault("__children", {})
+				children.setdefault(node.get("__typename"), []).append(node)
+			else:
+				if record:
+					yield record
+				record, nodes = node, {}
+
+			_index_nodes(node, nodes)
+
+	if record:
+		yield record
+
+
+def _index_nodes(node, nodes: dict) -> None:
+	if isinstance(node, list):
+		for d in node:
+			_index_nodes(d, nodes)
+	elif isinstance(node, dict):
+		if node.get("id"):
+			nodes[node["id"]] = node
+		for key, value in node.items():
+			if key != "__children":
+				_index_nodes(value, nodes)
+
+
+def _get_children(node: dict, typename: str) -> list[dict]:
+	return (node.get("__children") or {}).get(typename) or []
+
+
+def _get_id(node: dict | None) -> str | None:
+	return from_gid(node["id"]) if node else None
+
+
+def _get_amount(money_bag: dict | None) -> str | None:
+	return money_bag["shopMoney"]["amount"] if money_bag else None
+
+
+def _to_rest_orders(orders: list[dict]) -> Iterator[dict]:
+	fulfillments = {d["id"]: d for order in orders for d in order.get("fulfillments") or []}
+
+	for ids in create_batch(list(fulfillments), FULFILLMENT_BATCH_SIZE):
+		for node in execute_graphql(FULFILLMENT_LINE_ITEMS_QUERY, {"ids": ids})["nodes"]:
+			if node:
+				fulfillments[node["id"]]["fulfillmentLineItems"] = node["fulfillmentLineItems"]["nodes"]
+
+	for order in orders:
+		yield _to_rest_order(order)
+
+
+def _to_rest_order(order: dict) -> dict:
+	return {
+		"id": from_gid(order["id"]),
+		"name": order["name"],
+		"created_at": order["createdAt"],
+		"email": order.get("email"),
+		"phone": order.get("phone"),
+		"note": order.get("note"),
+		"taxes_included": order.get("taxesIncluded"),
+		"financial_status": (order.get("displayFinancialStatus") or "").lower(),
+		"customer": _to_rest_customer(order.get("customer")),
+		"shipping_address": _to_rest_address(order.get("shippingAddress")),
+		"billing_address": _to_rest_address(order.get("billingAddress")),
+		"tax_lines": _to_rest_tax_lines(order.get("taxLines")),
+		"line_items": [_to_rest_line_item(d) for d in _get_children(order, "LineItem")],
+		"shipping_lines": [_to_rest_shipping_line(d) for d in _get_children(order, "ShippingLine")],
+		"fulfillments": [_to_rest_fulfillment(d, order) for d in order.get("fulfillments") or []],
+	}
+
+
+def _to_rest_customer(customer: dict | None) -> dict | None:
+	if not customer:
+		return None
+
+	return {
+		"id": _get_id(customer),
+		"first_name": customer.get("firstName"),
+		"last_name": customer.get("lastName"),
+		"email": customer.get("email"),
+		"phone": customer.get("phone"),
+	}
+
+
+def _to_rest_address(address: dict | None) -> dict | None:
+	if not address:
+		return None
+
+	return {
+		"name": address.get("name"),
+		"first_name": address.get("firstName"),
+		"last_name": address.get("lastName"),
+		"address1": address.get("address1"),
+		"address2": address.get("address2"),
+		"city": address.get("city"),
+		"province": address.get("province"),
+		"zip": address.get("zip"),
+		"country": address.get("country"),
+		"phone": address.get("phone"),
+	}
+
+
+def _to_rest_tax_lines(tax_lines: list | None) -> list[dict]:
+	return [
+		{"title": d.get("title"), "rate": flt(d.get("rate")), "price": _get_amount(d.get("priceSet"))}
+		for d in tax_lines or []
+	]
+
+
+def _to_rest_discount_allocations(discount_allocations: list | None) -> list[dict]:
+	return [{"amount": _get_amount(d.get("allocatedAmountSet"))} for d in discount_allocations or []]
+
+
+def _to_rest_line_item(line_item: dict) -> dict:
+	return {
+		"id": from_gid(line_item["id"]),
+		"title": line_item.get("title"),
+		"name": line_item.get("name"),
+		"quantity": line_item.get("quantity"),
+		"sku": line_item.get("sku"),
+		"product_id": _get_id(line_item.get("product")),
+		"variant_id": _get_id(line_item.get("variant")),
+		"product_exists": bool(line_item.get("product")),
+		"price": _get_amount(line_item.get("originalUnitPriceSet")),
+		"tax_lines": _to_rest_tax_lines(line_item.get("taxLines")),
+		"discount_allocations": _to_rest_discount_allocations(line_item.get("discountAllocations")),
+	}
+
+
+def _to_rest_shipping_line(shipping_line: dict) -> dict:
+	return {
+		"id": from_gid(shipping_line["id"]),
+		"title": shipping_line.get("title"),
+		"price": _get_amount(shipping_line.get("originalPriceSet")),
+		"discounted_price": _get_amount(shipping_line.get("discountedPriceSet")),
+		"tax_lines": _to_rest_tax_lines(shipping_line.get("taxLines")),
+		"discount_allocations": _to_rest_discount_allocations(shipping_line.get("discountAllocations")),
+	}
+
+
+def _to_rest_fulfillment(fulfillment: dict, order: dict) -> dict:
+	line_items = []
+	for d in fulfillment.get("fulfillmentLineItems") or []:
+		line_item = d.get("lineItem") or {}
+		line_items.append(
+			{
+				"id": _get_id(line_item),
+				"quantity": d.get("quantity"),
+				"sku": line_item.get("sku"),
+				"product_id": _get_id(line_item.get("product")),
+				"variant_id": _get_id(line_item.get("variant")),
+			}
+		)
+
+	return {
+		"id": from_gid(fulfillment["id"]),
+		"order_id": from_gid(order["id"]),
+		"created_at": fulfillment.get("createdAt"),
+		"location_id": _get_id(fulfillment.get("location")),
+		"line_items": line_items,
+	}
+
+
+def _to_rest_product(product: dict) -> dict:
+	options = product.get("options") or []
+
+	return {
+		"id": from_gid(product["id"]),
+		"title": product.get("title"),
+		"body_html": product.get("descriptionHtml"),
+		"product_type": product.get("productType"),
+		"vendor": product.get("vendor"),
+		"options": [{"name": d["name"], "values": d["values"]} for d in options],
+		"image": {"src": product["featuredImage"]["url"]} if product.get("featuredImage") else None,
+		"variants": [_to_rest_variant(d, options) for d in _get_children(product, "ProductVariant")],
+	}
+
+
+def _to_rest_variant(variant: dict, options: list[dict]) -> dict:
+	rest_variant = {
+		"id": from_gid(variant["id"]),
+		"title": variant.get("title"),
+		"sku": variant.get("sku"),
+		"price": variant.get("price"),
+		"weight": variant.get("weight"),
+		"weight_unit": WEIGHT_UNITS.get(variant.get("weightUnit")),
+		"inventory_item_id": _get_id(variant.get("inventoryItem")),
+	}
+
+	# REST has values of selected options in option1, option2... in the order of product's options
+	selected_options = {d["name"]: d["value"] for d in variant.get("selectedOptions") or []}
+	for option, attr in zip(options, SHOPIFY_VARIANTS_ATTR_LIST, strict=False):
+		rest_variant[attr] = selected_options.get(option["name"])
+
+	return rest_variant
@@ -3,23 +3,46 @@ import functools
 import hashlib
 import hmac
 import json
+import time
+import urllib.error
 
 import frappe
+import requests
 from frappe import _
+from frappe.utils.background_jobs import get_redis_conn
+from pyactiveresource.connection import ClientError
+from requests.adapters import HTTPAdapter
+from shopify.base import ShopifyConnection, ShopifyResource
 from shopify.resources import Webhook
 from shopify.session import Session
 
+from ecommerce_integrations.controllers.scheduling import single_instance
 from ecommerce_integrations.shopify.constants import (
+	API_CALL_LIMIT_KEY,
 	API_VERSION,
 	EVENT_MAPPER,
 	SETTING_DOCTYPE,
+	WEBHOOK_BUFFER_BATCH_SIZE,
+	WEBHOOK_BUFFER_KEY,
+	WEBHOOK_BUFFER_LEASE,
+	WEBHOOK_DEDUP_TTL,
 	WEBHOOK_EVENTS,
+	WEBHOOK_ID_KEY_PREFIX,
+	WEBHOOK_STATS_KEY,
 )
 from ecommerce_integrations.shopify.utils import create_shopify_log
 
+HTTP_POOL_SIZE = 16
+
+# decrypted credentials of each site, with `modified` of setting they were read from
+_auth_details_cache: dict[str, tuple] = {}
+
 
 def temp_shopify_session(func):
-	"""Any function that needs to access shopify api needs this decorator. The decorator starts a temp session that's destroyed when function returns."""
+	"""Any function that needs to access shopify api needs this decorator. The decorator starts a temp session that's destroyed when function returns.
+
+	REST API calls made in the session wait for their turn in call limit bucket shared by all workers
+	and reuse keep-alive connections of the worker, see `ShopifyAPIConnection`."""
 
 	@functools.wraps(func)
 	def wrapper(*args, **kwargs):
@@ -27,16 +50,211 @@ def temp_shopify_session(func):
 		if frappe.flags.in_test:
 			return func(*args, **kwargs)
 
-		setting = frappe.get_doc(SETTING_DOCTYPE)
+		setting = frappe.get_cached_doc(SETTING_DOCTYPE)
 		if setting.is_enabled():
-			auth_details = (setting.shopify_url, API_VERSION, setting.get_password("password"))
-
-			with Session.temp(*auth_details):
-				return func(*args, **kwargs)
+			outer_connection = getattr(ShopifyResource._threadlocal, "connection", None)
+			try:
+				with Session.temp(*_get_auth_details(setting)):
+					_activate_connection(APIRateLimiter(setting.shopify_url))
+					return func(*args, **kwargs)
+			finally:
+				# restoring session of outer function resets its connection too
+				if isinstance(outer_connection, ShopifyAPIConnection):
+					ShopifyResource._threadlocal.connection = outer_connection
 
 	return wrapper
 
 
+def get_current_session_details() -> tuple[str, dict, "APIRateLimiter | None"]:
+	"""Get site, headers and rate limiter of active session, used for activating same session in other threads.
+
+	Shopify resources keep session details in thread locals, so threads don't share active session."""
+	limiter = getattr(getattr(ShopifyResource._threadlocal, "connection", None), "limiter", None)
+	return ShopifyResource.site, dict(ShopifyResource.headers), limiter
+
+
+def activate_session_in_thread(site: str, headers: dict, limiter: "APIRateLimiter | None" = None) -> None:
+	ShopifyResource.site = site
+	ShopifyResource.headers = dict(headers)
+	if limiter:
+		_activate_connection(limiter)
+
+
+def _get_auth_details(setting) -> tuple[str, str, str]:
+	"""Get session details of setting, password is decrypted once per worker until setting is changed."""
+	modified, auth_details = _auth_details_cache.get(frappe.local.site, (None, None))
+	if modified != setting.modified:
+		auth_details = (setting.shopify_url, API_VERSION, setting.get_password("password"))
+		_auth_details_cache[frappe.local.site] = (setting.modified, auth_details)
+
+	return auth_details
+
+
+def _activate_connection(limiter: "APIRateLimiter") -> None:
+	# connection is reset whenever session changes, so it's replaced after activating session.
+	ShopifyResource._threadlocal.connection = ShopifyAPIConnection(
+		ShopifyResource.site,
+		ShopifyResource.user,
+		ShopifyResource.password,
+		ShopifyResource.timeout,
+		ShopifyResource.format,
+		limiter=limiter,
+	)
+
+
+# Take a call from bucket if available capacity allows, otherwise return seconds to wait.
+# Bucket drains at 1/20th of its size per second, i.e. 2/s for 40 and 20/s for 400 (Shopify Plus).
+_ACQUIRE_SCRIPT = """
+local now = redis.call("TIME")
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+
+local bucket = redis.call("HMGET", KEYS[1], "level", "limit", "updated_at")
+local limit = tonumber(bucket[2]) or tonumber(ARGV[2])
+local leak_rate = limit / 20
+local level = math.max(0, (tonumber(bucket[1]) or 0) - (now - (tonumber(bucket[3]) or now)) * leak_rate)
+
+local available = limit * (1 - tonumber(ARGV[1]))
+if level + 1 > available then
+	return tostring((level + 1 - available) / leak_rate)
+end
+
+redis.call("HSET", KEYS[1], "level", level + 1, "limit", limit, "updated_at", now)
+redis.call("EXPIRE", KEYS[1], 60)
+return "0"
+"""
+
+# Sync bucket with call limit reported by shopify, calls of this bucket that are still in flight
+# aren't counted by shopify yet, so the higher of both levels is kept.
+_UPDATE_SCRIPT = """
+local now = redis.call("TIME")
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+
+local bucket = redis.call("HMGET", KEYS[1], "level", "limit", "updated_at")
+local limit = tonumber(ARGV[2])
+local leak_rate = limit / 20
+local level = math.max(0, (tonumber(bucket[1]) or 0) - (now - (tonumber(bucket[3]) or now)) * leak_rate)
+
+redis.call("HSET", KEYS[1], "level", math.max(level, tonumber(ARGV[1])), "limit", limit, "updated_at", now)
+redis.call("EXPIRE", KEYS[1], 60)
+"""
+
+
+class APIRateLimiter:
+	"""Leaky bucket for REST API calls made to a shop, shared by all workers and sites on bench.
+
+	Every call takes a slot in the bucket kept in redis cache, bucket is synced with usage reported by
+	`X-Shopify-Shop-Api-Call-Limit` header (e.g. 32/40) after each call. Background jobs leave a part
+	of the bucket free so that interactive requests (e.g. saving an Item) aren't held up by bulk syncs.
+	"""
+
+	CALL_LIMIT_HEADER = "X-Shopify-Shop-Api-Call-Limit"
+	DEFAULT_LIMIT = 40
+
+	# fraction of bucket left free by callers
+	INTERACTIVE_RESERVE = 0.05
+	BACKGROUND_RESERVE = 0.25
+
+	def __init__(self, shopify_url: str, interactive: bool | None = None):
+		if interactive is None:
+			interactive = bool(getattr(frappe.local, "request", None))
+
+		# redis client is kept as worker threads don't have site context
+		self.redis = frappe.cache()
+		self.key = f"{API_CALL_LIMIT_KEY}:{shopify_url}"
+		self.reserve = self.INTERACTIVE_RESERVE if interactive else self.BACKGROUND_RESERVE
+
+	def acquire(self) -> None:
+		while wait := float(self.redis.eval(_ACQUIRE_SCRIPT, 1, self.key, self.reserve, self.DEFAULT_LIMIT)):
+			time.sleep(wait)
+
+	def update(self, response, throttled: bool = False) -> None:
+		call_limit = _get_header(getattr(response, "headers", None), self.CALL_LIMIT_HEADER)
+		if not call_limit:
+			return
+
+		used, limit = (int(d) for d in call_limit.split("/"))
+		self.redis.eval(_UPDATE_SCRIPT, 1, self.key, limit if throttled else used, limit)
+
+
+class ShopifyAPIConnection(ShopifyConnection):
+	"""Connection that takes a slot from `APIRateLimiter` before every request.
+
+	Requests are sent over keep-alive connections pooled per worker instead of opening a new
+	connection (and TLS handshake) for every request. Requests throttled by shopify anyway (429) are
+	retried after `Retry-After` seconds."""
+
+	MAX_RETRIES = 3
+
+	def __init__(self, *args, limiter: APIRateLimiter, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.limiter = limiter
+
+	def _open(self, *args, **kwargs):
+		for attempt in range(self.MAX_RETRIES + 1):
+			self.limiter.acquire()
+			try:
+				response = super()._open(*args, **kwargs)
+			except ClientError as e:
+				throttled = e.response.code == 429
+				self.limiter.update(e.response, throttled=throttled)
+				if not throttled or attempt == self.MAX_RETRIES:
+					raise
+
+				time.sleep(float(_get_header(e.response.headers, "Retry-After") or 2))
+			else:
+				self.limiter.update(response)
+				return response
+
+	def _urlopen(self, request):
+		try:
+			response = _get_http_session().request(
+				request.get_method(),
+				request.full_url,
+				data=request.data,
+				headers=dict(request.header_items()),
+				timeout=self.timeout,
+				allow_redirects=False,
+			)
+		except requests.RequestException as e:
+			raise urllib.error.URLError(e) from e
+
+		return _PooledResponse(response)
+
+
+class _PooledResponse:
+	"""Response of pooled connection in the shape of `urlopen` response expected by pyactiveresource."""
+
+	def __init__(self, response: requests.Response):
+		self.code = response.status_code
+		self.msg = response.reason
+		self.headers = response.headers
+		self.url = response.url  # read by errors raised for non 2xx responses
+		self._response = response
+
+	def geturl(self) -> str:
+		return self.url
+
+	def read(self) -> bytes:
+		return self._response.content
+
+	def close(self) -> None:
+		self._response.close()
+
+
+@functools.cache
+def _get_http_session() -> requests.Session:
+	# connections are pooled per host, pool is shared by threads of worker (e.g. inventory sync)
+	session = requests.Session()
+	session.mount("https://", HTTPAdapter(pool_maxsize=HTTP_POOL_SIZE))
+	return session
+
+
+def _get_header(headers, header) -> str | None:
+	for key, value in (headers or {}).items():
+		if key.lower() == header.lower():
+			return value
+
+
 def register_webhooks(shopify_url: str, password: str) -> list[Webhook]:
 	"""Register required webhooks with shopify and return registered webhooks."""
 	new_webhooks = []
@@ -98,16 +316,34 @@ def store_request_data() -> None:
 
 		_validate_request(frappe.request, hmac_header)
 
-		data = json.loads(frappe.request.data)
+		webhook_id = frappe.get_request_header("X-Shopify-Webhook-Id")
+		if _is_duplicate_webhook(webhook_id):
+			return
+
 		event = frappe.request.headers.get("X-Shopify-Topic")
 
-		process_request(data, event)
+		try:
+			if frappe.get_cached_doc(SETTING_DOCTYPE).buffer_webhooks:
+				_buffer_request(frappe.request.data, event)
+			else:
+				process_request(json.loads(frappe.request.data), event)
+		except Exception:
+			# let shopify's redelivery go through
+			_forget_webhook(webhook_id)
+			raise
 
 
 def process_request(data, event):
 	# create log
 	log = create_shopify_log(method=EVENT_MAPPER[event], request_data=data)
 
+	# local import to avoid circular dependencies
+	from ecommerce_integrations.shopify.sequencing import SEQUENCED_EVENTS, queue_order_event
+
+	if event in SEQUENCED_EVENTS:
+		queue_order_event(data, event, log.name)
+		return
+
 	# enqueue backround job
 	frappe.enqueue(
 		method=EVENT_MAPPER[event],
@@ -118,9 +354,83 @@ def process_request(data, event):
 	)
 
 
+def _buffer_request(data: bytes, event: str) -> None:
+	"""Append raw webhook to buffer, logs and sync jobs are created later by `process_webhook_buffer`.
+
+	Buffer is stored in redis used for background jobs, which is persisted unlike redis cache."""
+	entry = json.dumps({"event": event, "data": frappe.safe_decode(data)})
+
+	if get_redis_conn().rpush(_get_webhook_buffer_key(), entry) == 1:
+		# buffer was empty, start draining it. Scheduled run picks up anything missed.
+		frappe.enqueue(process_webhook_buffer, queue="short")
+
+
+@single_instance(WEBHOOK_BUFFER_LEASE)
+def process_webhook_buffer() -> None:
+	"""Create logs and enqueue sync jobs for buffered webhooks.
+
+	Entries are removed from buffer only after they are processed, if worker dies in between
+	the batch is processed again. Duplicate orders are skipped by sync jobs."""
+	redis = get_redis_conn()
+	key = _get_webhook_buffer_key()
+
+	while entries := redis.lrange(key, 0, WEBHOOK_BUFFER_BATCH_SIZE - 1):
+		for entry in entries:
+			_process_buffered_request(json.loads(entry))
+		redis.ltrim(key, len(entries), -1)
+
+
+def _process_buffered_request(entry: dict) -> None:
+	try:
+		process_request(json.loads(entry["data"]), entry["event"])
+	except Exception:
+		frappe.db.rollback()
+		create_shopify_log(status="Error", request_data=entry["data"], make_new=True)
+
+
+def _get_webhook_buffer_key() -> str:
+	# job redis is shared by all sites on bench
+	return f"{frappe.local.site}:{WEBHOOK_BUFFER_KEY}"
+
+
+def _is_duplicate_webhook(webhook_id: str | None) -> bool:
+	"""Check if webhook was already delivered and remember it for `WEBHOOK_DEDUP_TTL` seconds.
+
+	Shopify redelivers webhooks if response isn't received in time, redeliveries have same webhook id."""
+	cache = frappe.cache()
+	stats_key = cache.make_key(WEBHOOK_STATS_KEY)
+
+	cache.hincrby(stats_key, "received", 1)
+	if not webhook_id:
+		return False
+
+	if cache.set(_get_webhook_id_key(webhook_id), 1, nx=True, ex=WEBHOOK_DEDUP_TTL):
+		return False
+
+	cache.hincrby(stats_key, "duplicates", 1)
+	return True
+
+
+def _forget_webhook(webhook_id: str | None) -> None:
+	if webhook_id:
+		frappe.cache().delete(_get_webhook_id_key(webhook_id))
+
+
+def _get_webhook_id_key(webhook_id: str) -> str:
+	return frappe.cache().make_key(f"{WEBHOOK_ID_KEY_PREFIX}:{webhook_id}")
+
+
+def get_webhook_stats() -> dict[str, int]:
+	"""Get count of received and duplicate (redelivered) webhooks."""
+	stats = frappe.cache().hgetall(frappe.cache().make_key(WEBHOOK_STATS_KEY))
+	return {
+		"received": int(stats.get(b"received", 0)),
+		"duplicates": int(stats.get(b"duplicates", 0)),
+	}
+
+
 def _validate_request(req, hmac_header):
-	settings = frappe.get_doc(SETTING_DOCTYPE)
-	secret_key = settings.shared_secret
+	secret_key = frappe.get_cached_doc(SETTING_DOCTYPE).shared_secret
 
 	sig = base64.b64encode(hmac.new(secret_key.encode("utf8"), req.data, hashlib.sha256).digest())
 
@@ -8,6 +8,52 @@ OLD_SETTINGS_DOCTYPE = "Shopify Settings"
 
 API_VERSION = "2024-01"
 
+# Maximum number of quantities accepted by single `inventorySetQuantities` mutation
+INVENTORY_SET_QUANTITIES_LIMIT = 250
+
+# job leases, only one instance of these jobs runs at a time
+INVENTORY_SYNC_LEASE = "shopify_inventory_sync"
+OLD_ORDERS_SYNC_LEASE = "shopify_old_orders_sync"
+PRODUCT_IMPORT_LEASE = "shopify_product_import"
+ORDER_RECONCILIATION_LEASE = "shopify_order_reconciliation"
+
+JOB_LEASES = {
+	INVENTORY_SYNC_LEASE: "Inventory Sync",
+	OLD_ORDERS_SYNC_LEASE: "Old Orders Sync",
+	PRODUCT_IMPORT_LEASE: "Product Import",
+	ORDER_RECONCILIATION_LEASE: "Order Reconciliation",
+}
+
+# shopify retries failed webhooks for 48 hours, remember delivered webhook ids for that long
+WEBHOOK_DEDUP_TTL = 48 * 60 * 60
+WEBHOOK_ID_KEY_PREFIX = "shopify_webhook_id"
+WEBHOOK_STATS_KEY = "shopify_webhook_stats"
+
+# webhooks acknowledged before processing, see connection.process_webhook_buffer
+WEBHOOK_BUFFER_KEY = "shopify_webhook_buffer"
+WEBHOOK_BUFFER_BATCH_SIZE = 100
+WEBHOOK_BUFFER_LEASE = "shopify_webhook_buffer"
+
+# old orders synced in parallel shards, see backfill.py
+BACKFILL_KEY = "shopify_old_orders_backfill"
+BACKFILL_SHARD_LEASE = "shopify_old_orders_shard"
+
+# new order webhooks synced in batches, see order.sync_queued_orders
+ORDER_BATCH_KEY = "shopify_order_batch"
+ORDER_BATCH_LEASE = "shopify_order_batch"
+
+# order webhooks processed in sequence per order, see sequencing.py
+ORDER_EVENTS_KEY = "shopify_order_events"
+ORDER_EVENTS_LEASE = "shopify_order_events"
+PENDING_ORDERS_KEY = "shopify_pending_orders"
+
+# pending stages and delayed retries of order stages, see pipeline.py
+ORDER_STAGES_KEY = "shopify_order_stages"
+ORDER_STAGE_RETRIES_KEY = "shopify_order_stage_retries"
+
+# REST API call limit bucket shared by all workers, see connection.APIRateLimiter
+API_CALL_LIMIT_KEY = "shopify_api_call_limit"
+
 WEBHOOK_EVENTS = [
 	"orders/create",
 	# "orders/paid",
@@ -35,6 +35,72 @@ frappe.ui.form.on("Shopify Setting", {
 			});
 		});
 		frm.trigger("setup_queries");
+		frm.trigger("show_running_jobs");
+		frm.trigger("show_webhook_stats");
+		frm.trigger("show_old_orders_sync_progress");
+	},
+
+	show_old_orders_sync_progress: function (frm) {
+		if (!frm.doc.sync_old_orders || !frappe.user.has_role("System Manager")) return;
+
+		const show_progress = (progress) => {
+			if (!progress || !progress.total) return;
+
+			frm.dashboard.show_progress(
+				__("Syncing Old Orders"),
+				progress.percent,
+				__("{0} of {1} orders synced, {2} orders/sec", [
+					progress.synced,
+					progress.total,
+					progress.orders_per_second,
+				])
+			);
+		};
+
+		frappe.call({
+			method: "ecommerce_integrations.shopify.doctype.shopify_setting.shopify_setting.get_old_orders_sync_progress",
+			callback: (r) => show_progress(r.message),
+		});
+
+		frappe.realtime.off("shopify_old_orders_progress");
+		frappe.realtime.on("shopify_old_orders_progress", show_progress);
+	},
+
+	show_webhook_stats: function (frm) {
+		if (!frm.doc.enable_shopify || !frappe.user.has_role("System Manager")) return;
+
+		frappe.call({
+			method: "ecommerce_integrations.shopify.doctype.shopify_setting.shopify_setting.get_webhook_stats",
+			callback: (r) => {
+				if (!r.message || !r.message.received) return;
+
+				frm.dashboard.set_headline(
+					__("Webhooks received: {0}, duplicate deliveries skipped: {1}", [
+						r.message.received,
+						r.message.duplicates,
+					])
+				);
+			},
+		});
+	},
+
+	show_running_jobs: function (frm) {
+		frappe.call({
+			method: "ecommerce_integrations.shopify.doctype.shopify_setting.shopify_setting.get_running_jobs",
+			callback: (r) => {
+				if (!r.message || !r.message.length) return;
+
+				const jobs = r.message.map((job) =>
+					__("{0} is running on {1} since {2} (lease expires in {3}s)", [
+						job.job,
+						job.owner,
+						frappe.datetime.str_to_user(job.acquired_at),
+						job.expires_in,
+					])
+				);
+				frm.set_intro(jobs.join("<br>"), "blue");
+			},
+		});
 	},
 
 	setup_queries: function (frm) {
@@ -48,11 +114,15 @@ frappe.ui.form.on("Shopify Setting", {
 			};
 		};
 		frm.set_query("warehouse", warehouse_query);
-		frm.set_query(
-			"erpnext_warehouse",
-			"shopify_warehouse_mapping",
-			warehouse_query
-		);
+		// group warehouses are synced with consolidated stock of all child warehouses
+		frm.set_query("erpnext_warehouse", "shopify_warehouse_mapping", () => {
+			return {
+				filters: {
+					company: frm.doc.company,
+					disabled: 0,
+				},
+			};
+		});
 
 		frm.set_query("price_list", () => {
 			return {
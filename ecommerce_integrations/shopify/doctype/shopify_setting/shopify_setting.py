@@ -5,9 +5,9 @@ import frappe
 from frappe import _
 from frappe.custom.doctype.custom_field.custom_field import create_custom_fields
 from frappe.utils import get_datetime
-from shopify.collection import PaginatedIterator
 from shopify.resources import Location
 
+from ecommerce_integrations.controllers.scheduling import get_lease
 from ecommerce_integrations.controllers.setting import (
 	ERPNextWarehouse,
 	IntegrationWarehouse,
@@ -19,12 +19,14 @@ from ecommerce_integrations.shopify.constants import (
 	CUSTOMER_ID_FIELD,
 	FULLFILLMENT_ID_FIELD,
 	ITEM_SELLING_RATE_FIELD,
+	JOB_LEASES,
 	ORDER_ID_FIELD,
 	ORDER_ITEM_DISCOUNT_FIELD,
 	ORDER_NUMBER_FIELD,
 	ORDER_STATUS_FIELD,
 	SUPPLIER_ID_FIELD
 )
+from ecommerce_integrations.shopify.paginator import PagePrefetcher, collection_page_fetcher
 from ecommerce_integrations.shopify.utils import (
 	ensure_old_connector_is_disabled,
 	migrate_from_old_connector,
@@ -49,6 +51,7 @@ class ShopifySetting(SettingController):
 		from ecommerce_integrations.shopify.doctype.shopify_webhooks.shopify_webhooks import ShopifyWebhooks
 
 		add_shipping_as_item: DF.Check
+		buffer_webhooks: DF.Check
 		cash_bank_account: DF.Link | None
 		company: DF.Link | None
 		consolidate_taxes: DF.Check
@@ -59,13 +62,19 @@ class ShopifySetting(SettingController):
 		default_shipping_charges_account: DF.Link | None
 		delivery_note_series: DF.Literal[None]
 		enable_shopify: DF.Check
+		inventory_sync_concurrency: DF.Int
 		inventory_sync_frequency: DF.Literal["5", "10", "15", "30", "60"]
+		inventory_sync_method: DF.Literal["REST", "GraphQL"]
 		is_old_data_migrated: DF.Check
 		last_inventory_sync: DF.Datetime | None
 		old_orders_from: DF.Datetime | None
+		old_orders_sync_jobs: DF.Int
 		old_orders_to: DF.Datetime | None
+		order_sync_batch_size: DF.Int
+		orders_reconciled_till: DF.Datetime | None
 		password: DF.Password | None
 		personally_identifiable_information_access: DF.Check
+		reconcile_missed_orders: DF.Check
 		sales_invoice_series: DF.Literal[None]
 		sales_order_series: DF.Literal[None]
 		shared_secret: DF.Data | None
@@ -73,6 +82,7 @@ class ShopifySetting(SettingController):
 		shopify_url: DF.Data | None
 		shopify_warehouse_mapping: DF.Table[ShopifyWarehouseMapping]
 		sync_delivery_note: DF.Check
+		sync_inventory_on_stock_change: DF.Check
 		sync_new_item_as_active: DF.Check
 		sync_old_orders: DF.Check
 		sync_sales_invoice: DF.Check
@@ -81,6 +91,7 @@ class ShopifySetting(SettingController):
 		update_shopify_item_on_update: DF.Check
 		upload_erpnext_items: DF.Check
 		upload_variants_as_items: DF.Check
+		use_bulk_operations: DF.Check
 		warehouse: DF.Link | None
 		webhooks: DF.Table[ShopifyWebhooks]
 	# end: auto-generated types
@@ -100,6 +111,16 @@ class ShopifySetting(SettingController):
 			setup_custom_fields()
 
 	def on_update(self):
+		# local import to avoid circular dependencies
+		from ecommerce_integrations.shopify.backfill import clear_backfill
+		from ecommerce_integrations.shopify.order import clear_tax_accounts_cache
+
+		clear_tax_accounts_cache()
+
+		if self.has_value_changed("old_orders_from") or self.has_value_changed("old_orders_to"):
+			# start sync of old orders again for new time range
+			clear_backfill()
+
 		if self.is_enabled() and not self.is_old_data_migrated:
 			migrate_from_old_connector()
 
@@ -137,12 +158,13 @@ class ShopifySetting(SettingController):
 		map it with correct ERPNext warehouse."""
 
 		self.shopify_warehouse_mapping = []
-		for locations in PaginatedIterator(Location.find()):
-			for location in locations:
-				self.append(
-					"shopify_warehouse_mapping",
-					{"shopify_location_id": location.id, "shopify_location_name": location.name},
-				)
+		with PagePrefetcher(collection_page_fetcher(Location)) as pages:
+			for locations in pages:
+				for location in locations:
+					self.append(
+						"shopify_warehouse_mapping",
+						{"shopify_location_id": location.id, "shopify_location_name": location.name},
+					)
 
 	def get_erpnext_warehouses(self) -> list[ERPNextWarehouse]:
 		return [wh_map.erpnext_warehouse for wh_map in self.shopify_warehouse_mapping]
@@ -158,6 +180,36 @@ class ShopifySetting(SettingController):
 		}
 
 
+@frappe.whitelist()
+def get_running_jobs() -> list[dict]:
+	"""Get scheduled jobs currently holding a lease, shown on Shopify Setting."""
+	if not frappe.has_permission("Shopify Setting", "write"):
+		return []
+
+	running_jobs = []
+	for lease_name, job in JOB_LEASES.items():
+		if lease := get_lease(lease_name):
+			running_jobs.append({"job": _(job), **lease})
+
+	return running_jobs
+
+
+@frappe.whitelist()
+def get_old_orders_sync_progress() -> dict:
+	frappe.only_for("System Manager")
+
+	# local import to avoid circular dependencies
+	from ecommerce_integrations.shopify.backfill import get_progress
+
+	return get_progress()
+
+
+@frappe.whitelist()
+def get_webhook_stats() -> dict[str, int]:
+	frappe.only_for("System Manager")
+	return connection.get_webhook_stats()
+
+
 def setup_custom_fields():
 	custom_fields = {
 		"Item": [
@@ -202,7 +254,8 @@ def setup_custom_fields():
 			dict(
 				fieldname=ORDER_ID_FIELD,
 				label="Shopify Order Id",
-				fieldtype="Small Text",
+				fieldtype="Data",
+				search_index=1,
 				insert_after="title",
 				read_only=1,
 				print_hide=1,
@@ -210,7 +263,8 @@ def setup_custom_fields():
 			dict(
 				fieldname=ORDER_NUMBER_FIELD,
 				label="Shopify Order Number",
-				fieldtype="Small Text",
+				fieldtype="Data",
+				search_index=1,
 				insert_after=ORDER_ID_FIELD,
 				read_only=1,
 				print_hide=1,
@@ -218,7 +272,7 @@ def setup_custom_fields():
 			dict(
 				fieldname=ORDER_STATUS_FIELD,
 				label="Shopify Order Status",
-				fieldtype="Small Text",
+				fieldtype="Data",
 				insert_after=ORDER_NUMBER_FIELD,
 				read_only=1,
 				print_hide=1,
@@ -237,7 +291,8 @@ def setup_custom_fields():
 			dict(
 				fieldname=ORDER_ID_FIELD,
 				label="Shopify Order Id",
-				fieldtype="Small Text",
+				fieldtype="Data",
+				search_index=1,
 				insert_after="title",
 				read_only=1,
 				print_hide=1,
@@ -245,7 +300,8 @@ def setup_custom_fields():
 			dict(
 				fieldname=ORDER_NUMBER_FIELD,
 				label="Shopify Order Number",
-				fieldtype="Small Text",
+				fieldtype="Data",
+				search_index=1,
 				insert_after=ORDER_ID_FIELD,
 				read_only=1,
 				print_hide=1,
@@ -253,7 +309,7 @@ def setup_custom_fields():
 			dict(
 				fieldname=ORDER_STATUS_FIELD,
 				label="Shopify Order Status",
-				fieldtype="Small Text",
+				fieldtype="Data",
 				insert_after=ORDER_NUMBER_FIELD,
 				read_only=1,
 				print_hide=1,
@@ -261,7 +317,8 @@ def setup_custom_fields():
 			dict(
 				fieldname=FULLFILLMENT_ID_FIELD,
 				label="Shopify Fulfillment Id",
-				fieldtype="Small Text",
+				fieldtype="Data",
+				search_index=1,
 				insert_after="title",
 				read_only=1,
 				print_hide=1,
@@ -272,7 +329,8 @@ def setup_custom_fields():
 			dict(
 				fieldname=ORDER_ID_FIELD,
 				label="Shopify Order Id",
-				fieldtype="Small Text",
+				fieldtype="Data",
+				search_index=1,
 				insert_after="title",
 				read_only=1,
 				print_hide=1,
@@ -280,7 +338,8 @@ def setup_custom_fields():
 			dict(
 				fieldname=ORDER_NUMBER_FIELD,
 				label="Shopify Order Number",
-				fieldtype="Small Text",
+				fieldtype="Data",
+				search_index=1,
 				insert_after=ORDER_ID_FIELD,
 				read_only=1,
 				print_hide=1,
@@ -288,7 +347,7 @@ def setup_custom_fields():
 			dict(
 				fieldname=ORDER_STATUS_FIELD,
 				label="Shopify Order Status",
-				fieldtype="Small Text",
+				fieldtype="Data",
 				insert_after=ORDER_ID_FIELD,
 				read_only=1,
 				print_hide=1,
@@ -1,4 +1,4 @@
-from copy import deepcopy
+from collections import defaultdict, deque
 
 import frappe
 from erpnext.selling.doctype.sales_order.sales_order import make_delivery_note
@@ -37,12 +37,22 @@ def prepare_delivery_note(payload, request_id=None):
 
 
 def create_delivery_note(shopify_order, setting, so):
+	# local import to avoid circular imports
+	from ecommerce_integrations.shopify.product import get_item_codes
+
 	if not cint(setting.sync_delivery_note):
 		return
 
-	for fulfillment in shopify_order.get("fulfillments"):
+	fulfillments = shopify_order.get("fulfillments")
+	item_codes = get_item_codes(
+		[line_item for fulfillment in fulfillments for line_item in fulfillment.get("line_items")]
+	)
+
+	for fulfillment in fulfillments:
 		if (
-			not frappe.db.get_value("Delivery Note", {FULLFILLMENT_ID_FIELD: fulfillment.get("id")}, "name")
+			not frappe.db.get_value(
+				"Delivery Note", {FULLFILLMENT_ID_FIELD: cstr(fulfillment.get("id"))}, "name"
+			)
 			and so.docstatus == 1
 		):
 			dn = make_delivery_note(so.name)
@@ -57,7 +67,7 @@ def create_delivery_note(shopify_order, setting, so):
 			dn.posting_date = getdate(fulfillment.get("created_at"))
 			dn.naming_series = setting.delivery_note_series or "DN-Shopify-"
 			dn.items = get_fulfillment_items(
-				dn.items, fulfillment.get("line_items"), fulfillment.get("location_id")
+				dn.items, fulfillment.get("line_items"), fulfillment.get("location_id"), item_codes=item_codes
 			)
 			dn.flags.ignore_mandatory = True
 			dn.save()
@@ -67,28 +77,30 @@ def create_delivery_note(shopify_order, setting, so):
 				dn.add_comment(text=f"Order Note: {shopify_order.get('note')}")
 
 
-def get_fulfillment_items(dn_items, fulfillment_items, location_id=None):
+def get_fulfillment_items(dn_items, fulfillment_items, location_id=None, item_codes=None):
 	# local import to avoid circular imports
-	from ecommerce_integrations.shopify.product import get_item_code
+	from ecommerce_integrations.shopify.product import get_item_code, get_item_codes
 
-	fulfillment_items = deepcopy(fulfillment_items)
+	if item_codes is None:
+		item_codes = get_item_codes(fulfillment_items)
 
 	setting = frappe.get_cached_doc(SETTING_DOCTYPE)
 	wh_map = setting.get_integration_to_erpnext_wh_mapping()
-	warehouse = wh_map.get(str(location_id)) or setting.warehouse
+	warehouse = wh_map.get(str(location_id))
+	if warehouse and frappe.get_cached_value("Warehouse", warehouse, "is_group"):
+		# group warehouses are only mapped for inventory sync, stock can't be delivered from them.
+		warehouse = None
+	warehouse = warehouse or setting.warehouse
 
-	final_items = []
-
-	def find_matching_fullfilement_item(dn_item):
-		nonlocal fulfillment_items
-
-		for item in fulfillment_items:
-			if get_item_code(item) == dn_item.item_code:
-				fulfillment_items.remove(item)
-				return item
+	# item_code -> fulfillment lines in their original order, each line is matched only once
+	fulfillment_item_map = defaultdict(deque)
+	for item in fulfillment_items:
+		fulfillment_item_map[get_item_code(item, item_codes)].append(item)
 
+	final_items = []
 	for dn_item in dn_items:
-		if shopify_item := find_matching_fullfilement_item(dn_item):
+		if matching_items := fulfillment_item_map.get(dn_item.item_code):
+			shopify_item = matching_items.popleft()
 			final_items.append(dn_item.update({"qty": shopify_item.get("quantity"), "warehouse": warehouse}))
 
 	return final_items
@@ -0,0 +1,36 @@
+import json
+
+import frappe
+from frappe import _
+from shopify.resources import GraphQL
+
+
+def execute_graphql(query: str, variables: dict | None = None) -> dict:
+	"""Execute GraphQL query against Shopify Admin API and return `data` of the response.
+
+	Needs an active shopify session, i.e. call this from a function decorated with `temp_shopify_session`.
+	Top level errors (invalid query, throttling etc) are raised, `userErrors` are left for caller to handle.
+	"""
+	response = json.loads(GraphQL().execute(query, variables=variables))
+
+	if response.get("errors"):
+		messages = ", ".join(_get_error_message(e) for e in response["errors"])
+		frappe.throw(_("Shopify GraphQL Error: {0}").format(messages))
+
+	return response.get("data") or {}
+
+
+def _get_error_message(error) -> str:
+	if isinstance(error, dict):
+		return str(error.get("message"))
+	return str(error)
+
+
+def to_gid(resource: str, id) -> str:
+	"""Convert REST id to GraphQL global id. E.g. gid://shopify/ProductVariant/1234"""
+	return f"gid://shopify/{resource}/{id}"
+
+
+def from_gid(gid: str) -> str:
+	"""Convert GraphQL global id to REST id."""
+	return gid.rsplit("/", 1)[-1] if gid else gid
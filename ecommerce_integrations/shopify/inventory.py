@@ -1,93 +1,538 @@
+import csv
+import gzip
+import json
+import tempfile
+import time
 from collections import Counter
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 
 import frappe
-from frappe.utils import cint, create_batch, now
+from frappe.utils import cint, cstr, now
 from pyactiveresource.connection import ResourceNotFound
 from shopify.resources import InventoryLevel, Variant
 
 from ecommerce_integrations.controllers.inventory import (
-	get_inventory_levels,
+	get_descendant_warehouses,
+	get_inventory_levels_of_bins,
+	get_inventory_levels_of_group_warehouses,
+	get_last_synced_qty,
+	iter_inventory_levels,
 	update_inventory_sync_status,
+	update_last_synced_inventory,
 )
-from ecommerce_integrations.controllers.scheduling import need_to_run
-from ecommerce_integrations.shopify.connection import temp_shopify_session
-from ecommerce_integrations.shopify.constants import MODULE_NAME, SETTING_DOCTYPE
+from ecommerce_integrations.controllers.scheduling import need_to_run, single_instance
+from ecommerce_integrations.ecommerce_integrations.doctype.ecommerce_item.ecommerce_item import (
+	get_inventory_item_id,
+	set_inventory_item_id,
+)
+from ecommerce_integrations.shopify.connection import (
+	activate_session_in_thread,
+	get_current_session_details,
+	temp_shopify_session,
+)
+from ecommerce_integrations.shopify.constants import (
+	INVENTORY_SET_QUANTITIES_LIMIT,
+	INVENTORY_SYNC_LEASE,
+	MODULE_NAME,
+	SETTING_DOCTYPE,
+)
+from ecommerce_integrations.shopify.graphql import execute_graphql, from_gid, to_gid
 from ecommerce_integrations.shopify.utils import create_shopify_log
 
+VARIANT_INVENTORY_ITEM_QUERY = """
+query ($ids: [ID!]!) {
+	nodes(ids: $ids) {
+		... on ProductVariant {
+			id
+			inventoryItem {
+				id
+			}
+		}
+	}
+}
+"""
+
+INVENTORY_SET_QUANTITIES_MUTATION = """
+mutation ($input: InventorySetQuantitiesInput!) {
+	inventorySetQuantities(input: $input) {
+		userErrors {
+			code
+			field
+			message
+		}
+	}
+}
+"""
+
+# redis set of json encoded [item_code, warehouse] changed since last sync
+CHANGED_BINS_KEY = "shopify_inventory_changed_bins"
+
+# rows with these statuses are marked as synced and not picked up again until Bin changes
+SYNCED_STATUSES = ("Success", "Not Found", "Skipped")
+
+# userErrors of rows whose inventory item or location is deleted on Shopify
+NOT_FOUND_ERROR_CODES = ("INVALID_INVENTORY_ITEM", "INVALID_LOCATION")
 
+INVENTORY_SET_QUANTITIES_INPUT = {
+	"name": "available",
+	"reason": "correction",
+	"ignoreCompareQuantity": True,
+}
+
+
+@single_instance(INVENTORY_SYNC_LEASE)
 def update_inventory_on_shopify() -> None:
 	"""Upload stock levels from ERPNext to Shopify.
 
-	Called by scheduler on configured interval.
+	Called by scheduler every minute. Bins changed since last run are pushed right away if
+	"Push Stock Changes Every Minute" is enabled, all modified bins are reconciled on configured interval.
 	"""
 	setting = frappe.get_doc(SETTING_DOCTYPE)
 
 	if not setting.is_enabled() or not setting.update_erpnext_stock_levels_to_shopify:
 		return
 
-	if not need_to_run(SETTING_DOCTYPE, "inventory_sync_frequency", "last_inventory_sync"):
+	warehous_map = setting.get_erpnext_to_integration_wh_mapping()
+	group_warehouses = _get_group_warehouses(warehous_map)
+	leaf_warehouses = tuple(wh for wh in warehous_map if wh not in group_warehouses)
+
+	if need_to_run(SETTING_DOCTYPE, "inventory_sync_frequency", "last_inventory_sync"):
+		# full sweep also covers changed bins, discard them before querying so none are missed.
+		_pop_changed_bins()
+		inventory_levels = _get_modified_inventory_levels(leaf_warehouses, group_warehouses)
+	elif setting.sync_inventory_on_stock_change:
+		inventory_levels = _get_changed_inventory_levels(
+			_pop_changed_bins(), leaf_warehouses, group_warehouses
+		)
+	else:
+		return
+
+	upload_inventory_data_to_shopify(inventory_levels, warehous_map)
+
+
+def mark_bin_as_changed(doc, method=None) -> None:
+	"""Track (item_code, warehouse) of changed stock so that it's pushed in next scheduler run.
+
+	Called by Bin and Stock Ledger Entry document events. Changes that don't trigger
+	document events are picked up by periodic full inventory sync."""
+	setting = frappe.get_cached_doc(SETTING_DOCTYPE)
+
+	if not (
+		setting.is_enabled()
+		and setting.update_erpnext_stock_levels_to_shopify
+		and setting.sync_inventory_on_stock_change
+	):
 		return
 
 	warehous_map = setting.get_erpnext_to_integration_wh_mapping()
-	inventory_levels = get_inventory_levels(tuple(warehous_map.keys()), MODULE_NAME)
+	if doc.warehouse not in warehous_map and not any(
+		doc.warehouse in descendants for descendants in _get_group_warehouses(warehous_map).values()
+	):
+		return
+
+	changed_bin = json.dumps([doc.item_code, doc.warehouse])
+	# bin should only be read by sync after the change is committed
+	frappe.db.after_commit.add(lambda: frappe.cache().sadd(CHANGED_BINS_KEY, changed_bin))
+
+
+def _get_group_warehouses(warehouses) -> dict[str, set[str]]:
+	"""Get mapped group warehouses along with all of their descendant warehouses."""
+	return {
+		warehouse: set(get_descendant_warehouses(warehouse))
+		for warehouse in warehouses
+		if frappe.get_cached_value("Warehouse", warehouse, "is_group")
+	}
+
+
+def _get_modified_inventory_levels(leaf_warehouses, group_warehouses) -> Iterator:
+	# read before any row is synced, syncing updates `inventory_synced_on` used to find modified rows.
+	group_inventory_levels = (
+		get_inventory_levels_of_group_warehouses(tuple(group_warehouses), MODULE_NAME)
+		if group_warehouses
+		else []
+	)
+
+	if leaf_warehouses:
+		for page in iter_inventory_levels(leaf_warehouses, MODULE_NAME):
+			yield from page
 
-	if inventory_levels:
-		upload_inventory_data_to_shopify(inventory_levels, warehous_map)
+	yield from group_inventory_levels
+
+
+def _get_changed_inventory_levels(changed_bins, leaf_warehouses, group_warehouses) -> list:
+	inventory_levels = []
+
+	if leaf_bins := [b for b in changed_bins if b[1] in leaf_warehouses]:
+		inventory_levels.extend(get_inventory_levels_of_bins(leaf_bins, MODULE_NAME))
+
+	# (item_code, group warehouse) affected by changed bins of descendant warehouses
+	group_bins = {
+		(item_code, group)
+		for item_code, warehouse in changed_bins
+		for group, descendants in group_warehouses.items()
+		if warehouse in descendants
+	}
+	if group_bins:
+		levels = get_inventory_levels_of_group_warehouses(
+			tuple({group for _, group in group_bins}),
+			MODULE_NAME,
+			item_codes=list({item_code for item_code, _ in group_bins}),
+		)
+		inventory_levels.extend(d for d in levels if (d.item_code, d.warehouse) in group_bins)
+
+	return inventory_levels
+
+
+def _pop_changed_bins() -> list[tuple[str, str]]:
+	cache = frappe.cache()
+
+	changed_bins = cache.smembers(CHANGED_BINS_KEY)
+	if changed_bins:
+		cache.srem(CHANGED_BINS_KEY, *changed_bins)
+
+	return [tuple(json.loads(frappe.safe_decode(b))) for b in changed_bins]
 
 
 @temp_shopify_session
 def upload_inventory_data_to_shopify(inventory_levels, warehous_map) -> None:
+	setting = frappe.get_cached_doc(SETTING_DOCTYPE)
 	synced_on = now()
 
-	for inventory_sync_batch in create_batch(inventory_levels, 50):
-		for d in inventory_sync_batch:
-			d.shopify_location_id = warehous_map[d.warehouse]
-
-			try:
-				variant = Variant.find(d.variant_id)
-				inventory_id = variant.inventory_item_id
-
-				InventoryLevel.set(
-					location_id=d.shopify_location_id,
-					inventory_item_id=inventory_id,
-					# shopify doesn't support fractional quantity
-					available=cint(d.actual_qty) - cint(d.reserved_qty),
-				)
-				update_inventory_sync_status(d.ecom_item, time=synced_on)
-				d.status = "Success"
-			except ResourceNotFound:
-				# Variant or location is deleted, mark as last synced and ignore.
-				update_inventory_sync_status(d.ecom_item, time=synced_on)
-				d.status = "Not Found"
-			except Exception as e:
-				d.status = "Failed"
-				d.failure_reason = str(e)
-
-			frappe.db.commit()
-
-		_log_inventory_update_status(inventory_sync_batch)
-
-
-def _log_inventory_update_status(inventory_levels) -> None:
-	"""Create log of inventory update."""
-	log_message = "variant_id,location_id,status,failure_reason\n"
-
-	log_message += "\n".join(
-		f"{d.variant_id},{d.shopify_location_id},{d.status},{d.failure_reason or ''}"
-		for d in inventory_levels
-	)
+	if setting.inventory_sync_method == "GraphQL":
+		upload_batch, batch_size = _upload_inventory_batch_graphql, INVENTORY_SET_QUANTITIES_LIMIT
+	else:
+		upload_batch, batch_size = _upload_inventory_batch_rest, 50
+
+	with InventorySyncLog() as sync_log:
+		for inventory_sync_batch in _batched(inventory_levels, batch_size):
+			_upload_inventory_batch(inventory_sync_batch, upload_batch, warehous_map, synced_on)
+			sync_log.add(inventory_sync_batch)
+
+
+def _upload_inventory_batch(inventory_sync_batch, upload_batch, warehous_map, synced_on) -> None:
+	for d in inventory_sync_batch:
+		d.shopify_location_id = warehous_map[d.warehouse]
+
+	try:
+		if changed_rows := _skip_unchanged_inventory(inventory_sync_batch):
+			upload_batch(changed_rows)
+			_update_last_synced_inventory(changed_rows)
+
+		update_inventory_sync_status(
+			[d.ecom_item for d in inventory_sync_batch if d.status in SYNCED_STATUSES], time=synced_on
+		)
+		frappe.db.commit()
+	except Exception as e:
+		# Only this batch is retried in next sync, already committed batches are not affected.
+		frappe.db.rollback()
+		_mark_failed(inventory_sync_batch, str(e))
+
+
+def _batched(iterable, size) -> Iterator[list]:
+	"""Lazily split any iterable in lists of `size`, unlike `create_batch` this doesn't need a sequence."""
+	iterator = iter(iterable)
+	while batch := list(islice(iterator, size)):
+		yield batch
+
+
+def _skip_unchanged_inventory(inventory_sync_batch) -> list:
+	"""Mark rows whose available quantity is same as last pushed quantity as skipped.
+
+	Bins are modified by reservations, reposts etc without any change in available quantity.
+	Returns rows that need to be pushed to Shopify."""
+	changed_rows = []
+	for d in inventory_sync_batch:
+		if get_last_synced_qty(d, d.shopify_location_id) == _get_available_qty(d):
+			d.status = "Skipped"
+		else:
+			changed_rows.append(d)
+
+	return changed_rows
+
+
+def _update_last_synced_inventory(inventory_sync_batch) -> None:
+	synced_qty = {}
+	for d in inventory_sync_batch:
+		if d.status == "Success":
+			synced_qty.setdefault(d.ecom_item, {})[d.shopify_location_id] = _get_available_qty(d)
+
+	update_last_synced_inventory(synced_qty)
 
-	stats = Counter([d.status for d in inventory_levels])
 
-	percent_successful = stats["Success"] / len(inventory_levels)
+def _upload_inventory_batch_rest(inventory_sync_batch) -> None:
+	"""Update inventory levels one row at a time using REST API.
 
-	if percent_successful == 0:
-		status = "Failed"
-	elif percent_successful < 1:
-		status = "Partial Success"
+	Rows are pushed concurrently if "Inventory Sync Concurrency" is more than 1."""
+	setting = frappe.get_cached_doc(SETTING_DOCTYPE)
+	pool_size = max(cint(setting.inventory_sync_concurrency), 1)
+
+	for d in inventory_sync_batch:
+		d.inventory_item_id = d.inventory_item_id or get_inventory_item_id(d.ecom_item)
+
+	# worker threads don't have site context, only shopify API calls are made in threads.
+	# calls of all threads are throttled by rate limiter of the session.
+	if pool_size == 1:
+		for d in inventory_sync_batch:
+			_push_inventory_level(d)
 	else:
-		status = "Success"
+		with ThreadPoolExecutor(
+			max_workers=pool_size,
+			initializer=activate_session_in_thread,
+			initargs=get_current_session_details(),
+		) as executor:
+			list(executor.map(_push_inventory_level, inventory_sync_batch))
+
+	for d in inventory_sync_batch:
+		if d.fetched_inventory_item_id:
+			set_inventory_item_id(d.ecom_item, d.inventory_item_id)
+
+
+def _push_inventory_level(inventory_level) -> None:
+	d = inventory_level
+	try:
+		if not d.inventory_item_id:
+			d.inventory_item_id = Variant.find(d.variant_id).inventory_item_id
+			d.fetched_inventory_item_id = True
+
+		InventoryLevel.set(
+			location_id=d.shopify_location_id,
+			inventory_item_id=d.inventory_item_id,
+			available=_get_available_qty(d),
+		)
+		d.status = "Success"
+	except ResourceNotFound:
+		# Variant or location is deleted, mark as last synced and ignore.
+		d.status = "Not Found"
+	except Exception as e:
+		d.status = "Failed"
+		d.failure_reason = str(e)
+
+
+def _upload_inventory_batch_graphql(inventory_sync_batch) -> None:
+	"""Update inventory levels of entire batch using single `inventorySetQuantities` mutation.
+
+	Batch size should not exceed INVENTORY_SET_QUANTITIES_LIMIT."""
+	for d in inventory_sync_batch:
+		d.inventory_item_id = d.inventory_item_id or get_inventory_item_id(d.ecom_item)
+
+	if unresolved_rows := [d for d in inventory_sync_batch if not d.inventory_item_id]:
+		try:
+			inventory_item_ids = _get_inventory_item_ids(d.variant_id for d in unresolved_rows)
+		except Exception as e:
+			_mark_failed(unresolved_rows, str(e))
+		else:
+			for d in unresolved_rows:
+				if inventory_item_id := inventory_item_ids.get(str(d.variant_id)):
+					d.inventory_item_id = inventory_item_id
+					set_inventory_item_id(d.ecom_item, inventory_item_id)
+				else:
+					# Variant is deleted, mark as last synced and ignore.
+					d.status = "Not Found"
+
+	rows = [d for d in inventory_sync_batch if d.inventory_item_id]
+
+	# mutation is atomic, batch is resent without rows rejected by shopify till rest of it is applied.
+	while rows:
+		quantities = [
+			{
+				"inventoryItemId": to_gid("InventoryItem", d.inventory_item_id),
+				"locationId": to_gid("Location", d.shopify_location_id),
+				"quantity": _get_available_qty(d),
+			}
+			for d in rows
+		]
+
+		try:
+			response = execute_graphql(
+				INVENTORY_SET_QUANTITIES_MUTATION,
+				{"input": {**INVENTORY_SET_QUANTITIES_INPUT, "quantities": quantities}},
+			)
+			user_errors = response["inventorySetQuantities"]["userErrors"]
+		except Exception as e:
+			_mark_failed(rows, str(e))
+			return
+
+		rows = _update_status_from_user_errors(rows, user_errors)
+
+
+def _get_inventory_item_ids(variant_ids) -> dict[str, str]:
+	"""Get mapping of variant_id to inventory_item_id using single GraphQL query.
+
+	Variants which do not exist on Shopify are not present in returned dict."""
+	gids = [to_gid("ProductVariant", variant_id) for variant_id in variant_ids]
+	response = execute_graphql(VARIANT_INVENTORY_ITEM_QUERY, {"ids": gids})
+
+	return {
+		from_gid(node["id"]): from_gid(node["inventoryItem"]["id"])
+		for node in response.get("nodes") or []
+		if node and node.get("inventoryItem")
+	}
+
+
+def _update_status_from_user_errors(rows, user_errors) -> list:
+	"""Map `userErrors` of inventorySetQuantities mutation back to rows.
+
+	Errors point to rows using field path, e.g. ["input", "quantities", "2", "locationId"]. Rows
+	with errors are marked failed, or not found if their inventory item or location is deleted.
+	Mutation is not applied if there are any errors, so remaining rows are returned to be resent.
+	Errors that don't point to a row fail the entire batch."""
+	if not user_errors:
+		for d in rows:
+			d.status = "Success"
+		return []
+
+	row_errors = {}
+	batch_errors = []
+	for error in user_errors:
+		field = error.get("field") or []
+		if len(field) > 2 and field[1] == "quantities" and cstr(field[2]).isdigit():
+			row_errors.setdefault(cint(field[2]), []).append(error)
+		else:
+			batch_errors.append(error.get("message"))
+
+	if batch_errors or not any(idx < len(rows) for idx in row_errors):
+		messages = batch_errors or [
+			error.get("message") for errors in row_errors.values() for error in errors
+		]
+		_mark_failed(rows, "; ".join(messages))
+		return []
+
+	remaining_rows = []
+	for idx, d in enumerate(rows):
+		if idx not in row_errors:
+			remaining_rows.append(d)
+		elif all(error.get("code") in NOT_FOUND_ERROR_CODES for error in row_errors[idx]):
+			# Variant or location is deleted, mark as last synced and ignore.
+			d.status = "Not Found"
+		else:
+			d.status = "Failed"
+			d.failure_reason = "; ".join(error.get("message") for error in row_errors[idx])
+
+	return remaining_rows
+
+
+def _mark_failed(rows, reason) -> None:
+	for d in rows:
+		d.status = "Failed"
+		d.failure_reason = reason
+
+
+def _get_available_qty(inventory_level) -> int:
+	# shopify doesn't support fractional quantity
+	return cint(inventory_level.actual_qty) - cint(inventory_level.reserved_qty)
+
+
+class InventorySyncLog:
+	"""Collect status of all rows in an inventory sync run and create a single log for the run.
+
+	Counters are stored in response data, status of all rows is attached to the log as a
+	gzipped CSV and only failed rows are kept in the message for quick triage.
+	Rows are written to a temporary file as they are added, so memory usage doesn't grow with rows.
+	"""
+
+	CSV_HEADER = ("variant_id", "location_id", "status", "failure_reason")
+	MAX_INLINE_FAILURES = 1000
+
+	def __init__(self):
+		self.stats = Counter()
+		self.failed_rows = []
+		self.start_time = time.monotonic()
+		self.end_time = None
+
+		self._file = tempfile.TemporaryFile()
+		self._csv_file = gzip.open(self._file, "wt", newline="")
+		self._csv_writer = csv.writer(self._csv_file)
+		self._csv_writer.writerow(self.CSV_HEADER)
+
+	def add(self, inventory_levels) -> None:
+		for d in inventory_levels:
+			row = (d.variant_id, d.shopify_location_id, d.status, d.failure_reason or "")
+			self._csv_writer.writerow(row)
+			self.stats[d.status] += 1
+
+			if d.status == "Failed" and len(self.failed_rows) < self.MAX_INLINE_FAILURES:
+				self.failed_rows.append(row)
+
+	def save(self) -> None:
+		if not self.stats.total():
+			return
+
+		self.end_time = time.monotonic()
+		self._csv_file.close()
+		self._file.seek(0)
+
+		log = create_shopify_log(
+			method="update_inventory_on_shopify",
+			status=self.get_status(),
+			message=self.get_message(),
+			response_data=self.get_summary(),
+			make_new=True,
+		)
+
+		frappe.get_doc(
+			{
+				"doctype": "File",
+				"file_name": f"inventory_sync_{log.name}.csv.gz",
+				"attached_to_doctype": log.doctype,
+				"attached_to_name": log.name,
+				"is_private": 1,
+				"content": self._file.read(),
+			}
+		).insert(ignore_permissions=True)
+		frappe.db.commit()
+
+	def get_summary(self) -> dict:
+		return {
+			"total": self.stats.total(),
+			"success": self.stats["Success"],
+			"not_found": self.stats["Not Found"],
+			"failed": self.stats["Failed"],
+			"skipped": self.stats["Skipped"],
+			"duration": round((self.end_time or time.monotonic()) - self.start_time, 3),
+		}
+
+	def get_percent_successful(self) -> float:
+		# skipped rows were already up to date on shopify
+		pushed_rows = self.stats.total() - self.stats["Skipped"]
+		return self.stats["Success"] / pushed_rows if pushed_rows else 1
+
+	def get_status(self) -> str:
+		percent_successful = self.get_percent_successful()
+
+		if percent_successful == 0:
+			return "Failed"
+		elif percent_successful < 1:
+			return "Partial Success"
+		return "Success"
+
+	def get_message(self) -> str:
+		summary = self.get_summary()
+		message = (
+			f"Updated {self.get_percent_successful() * 100:.2f}% items in {summary['duration']}s\n"
+			f"Success: {summary['success']}, Not Found: {summary['not_found']}, "
+			f"Failed: {summary['failed']}, Skipped: {summary['skipped']}"
+		)
+
+		if self.failed_rows:
+			message += "\n\nFailed items:\n" + ",".join(self.CSV_HEADER) + "\n"
+			message += "\n".join(",".join(str(v) for v in row) for row in self.failed_rows)
+
+		if self.stats["Failed"] > len(self.failed_rows):
+			message += "\n\nCheck attached file for all failed items."
+
+		return message
+
+	def close(self) -> None:
+		self._csv_file.close()
+		self._file.close()
 
-	log_message = f"Updated {percent_successful * 100}% items\n\n" + log_message
+	def __enter__(self):
+		return self
 
-	create_shopify_log(method="update_inventory_on_shopify", status=status, message=log_message)
+	def __exit__(self, exc_type, *args):
+		try:
+			self.save()
+		finally:
+			self.close()
@@ -33,9 +33,13 @@ def prepare_sales_invoice(payload, request_id=None):
 		create_shopify_log(status="Error", exception=e, rollback=True)
 
 
-def create_sales_invoice(shopify_order, setting, so):
+def create_sales_invoice(shopify_order, setting, so, make_payment=True):
+	"""Create and submit sales invoice against sales order, returns created invoice.
+
+	Payment entry is also created unless `make_payment` is disabled, e.g. when it's created by a
+	separate stage of order pipeline."""
 	if (
-		not frappe.db.get_value("Sales Invoice", {ORDER_ID_FIELD: shopify_order.get("id")}, "name")
+		not frappe.db.get_value("Sales Invoice", {ORDER_ID_FIELD: cstr(shopify_order.get("id"))}, "name")
 		and so.docstatus == 1
 		and not so.per_billed
 		and cint(setting.sync_sales_invoice)
@@ -57,12 +61,14 @@ def create_sales_invoice(shopify_order, setting, so):
 		set_cost_center(sales_invoice.items, setting.cost_center)
 		sales_invoice.insert(ignore_mandatory=True)
 		sales_invoice.submit()
-		if sales_invoice.grand_total > 0:
+		if make_payment and sales_invoice.grand_total > 0:
 			make_payament_entry_against_sales_invoice(sales_invoice, setting, posting_date)
 
 		if shopify_order.get("note"):
 			sales_invoice.add_comment(text=f"Order Note: {shopify_order.get('note')}")
 
+		return sales_invoice
+
 
 def set_cost_center(items, cost_center):
 	for item in items:
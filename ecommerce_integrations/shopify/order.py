@@ -1,16 +1,22 @@
 import json
+import time
 from typing import Literal, Optional
 
 import frappe
 from frappe import _
 from frappe.utils import cint, cstr, flt, get_datetime, getdate, nowdate
-from shopify.collection import PaginatedIterator
+from frappe.utils.background_jobs import get_redis_conn
 from shopify.resources import Order
 
+from ecommerce_integrations.controllers.scheduling import single_instance
+from ecommerce_integrations.shopify.bulk import export_orders
 from ecommerce_integrations.shopify.connection import temp_shopify_session
 from ecommerce_integrations.shopify.constants import (
 	CUSTOMER_ID_FIELD,
 	EVENT_MAPPER,
+	OLD_ORDERS_SYNC_LEASE,
+	ORDER_BATCH_KEY,
+	ORDER_BATCH_LEASE,
 	ORDER_ID_FIELD,
 	ORDER_ITEM_DISCOUNT_FIELD,
 	ORDER_NUMBER_FIELD,
@@ -21,7 +27,12 @@ from ecommerce_integrations.shopify.constants import (
 	SHIPPING_PHONE_FIELD,
 )
 from ecommerce_integrations.shopify.customer import ShopifyCustomer
-from ecommerce_integrations.shopify.product import create_items_if_not_exist, get_item_code
+from ecommerce_integrations.shopify.paginator import PagePrefetcher
+from ecommerce_integrations.shopify.product import (
+	create_items_if_not_exist,
+	get_item_code,
+	get_item_codes,
+)
 from ecommerce_integrations.shopify.utils import create_shopify_log
 from ecommerce_integrations.utils.price_list import get_dummy_price_list
 from ecommerce_integrations.utils.taxation import get_dummy_tax_category
@@ -31,6 +42,10 @@ DEFAULT_TAX_FIELDS = {
 	"shipping": "default_shipping_charges_account",
 }
 
+TAX_ACCOUNTS_CACHE_KEY = "shopify_tax_accounts"
+OLD_ORDERS_PAGE_SIZE = 250
+ORDER_BATCH_TIME_LIMIT = 4 * 60  # seconds, job runs on short queue with 5 minute timeout
+
 
 def sync_sales_order(payload, request_id=None):
 	order = payload
@@ -38,7 +53,15 @@ def sync_sales_order(payload, request_id=None):
 	frappe.flags.request_id = request_id
 	# frappe.log_error(title="Incoming Sales Order Payload", message=frappe.as_json(payload))
 
-	if frappe.db.get_value("Sales Order", filters={ORDER_ID_FIELD: cstr(order["id"])}):
+	if sales_order := frappe.db.get_value("Sales Order", filters={ORDER_ID_FIELD: cstr(order["id"])}):
+		# local import to avoid circular dependencies
+		from ecommerce_integrations.shopify.pipeline import retry_failed_stages
+
+		# retried log of an order whose invoice, payment or delivery note stage had failed
+		if request_id and retry_failed_stages(order, sales_order, request_id):
+			create_shopify_log(status="Success", message="Failed stages of order queued for retry")
+			return
+
 		create_shopify_log(status="Invalid", message="Sales order already exists, not synced")
 		return
 	try:
@@ -47,7 +70,7 @@ def sync_sales_order(payload, request_id=None):
 
 		create_items_if_not_exist(order)
 
-		setting = frappe.get_doc(SETTING_DOCTYPE)
+		setting = frappe.get_cached_doc(SETTING_DOCTYPE)
 		create_order(order, setting, shipping_info=shipping_info)
 	except Exception as e:
 		create_shopify_log(status="Error", exception=e, rollback=True)
@@ -55,6 +78,70 @@ def sync_sales_order(payload, request_id=None):
 		create_shopify_log(status="Success")
 
 
+def queue_order_for_batch_sync(request_id: str) -> None:
+	"""Queue log of new order to be synced by `sync_queued_orders` instead of a separate job."""
+	get_redis_conn().rpush(_get_order_batch_key(), request_id)
+	frappe.enqueue(
+		sync_queued_orders,
+		queue="short",
+		job_id=ORDER_BATCH_KEY,
+		deduplicate=True,
+		enqueue_after_commit=True,
+	)
+
+
+@single_instance(ORDER_BATCH_LEASE)
+def sync_queued_orders() -> None:
+	"""Sync queued orders in batches.
+
+	All orders in a job share setting and tax account lookups. Each order is synced in its own
+	transaction and updates its own log, failed orders can be retried from log like before.
+	Job stops after `ORDER_BATCH_TIME_LIMIT`, remaining orders are synced by its next run from scheduler
+	or from next order webhook."""
+	redis = get_redis_conn()
+	key = _get_order_batch_key()
+	batch_size = (
+		cint(frappe.get_cached_value(SETTING_DOCTYPE, SETTING_DOCTYPE, "order_sync_batch_size")) or 50
+	)
+	deadline = time.monotonic() + ORDER_BATCH_TIME_LIMIT
+
+	while request_ids := redis.lrange(key, 0, batch_size - 1):
+		synced = 0
+		for request_id in request_ids:
+			_sync_queued_order(frappe.safe_decode(request_id))
+			synced += 1
+			if time.monotonic() > deadline:
+				break
+
+		redis.ltrim(key, synced, -1)
+		if time.monotonic() > deadline:
+			break
+
+
+def _sync_queued_order(request_id: str) -> None:
+	log = frappe.db.get_value(
+		"Ecommerce Integration Log", request_id, ["status", "request_data"], as_dict=True
+	)
+	# log could have been retried or deleted in the meantime
+	if not log or log.status != "Queued":
+		return
+
+	# local import to avoid circular dependencies
+	from ecommerce_integrations.shopify.sequencing import release_held_events
+
+	order = json.loads(log.request_data)
+
+	# start from a clean transaction, failures are rolled back only till here
+	frappe.db.commit()
+	sync_sales_order(order, request_id=request_id)
+	release_held_events(order["id"])
+
+
+def _get_order_batch_key() -> str:
+	# job redis is shared by all sites on bench
+	return f"{frappe.local.site}:{ORDER_BATCH_KEY}"
+
+
 def _extract_shipping_info(shopify_order):
 	"""Extract shipping customer info from Shopify order."""
 	shipping_address = shopify_order.get("shipping_address") or {}
@@ -94,17 +181,17 @@ def _extract_shipping_info(shopify_order):
 
 
 def create_order(order, setting, company=None, shipping_info=None):
+	"""Create sales order, invoice, payment and delivery notes are created by separate stages."""
 	# local import to avoid circular dependencies
-	from ecommerce_integrations.shopify.fulfillment import create_delivery_note
-	from ecommerce_integrations.shopify.invoice import create_sales_invoice
+	from ecommerce_integrations.shopify.pipeline import enqueue_order_stage
 
 	so = create_sales_order(order, setting, company, shipping_info=shipping_info)
 	if so:
 		if order.get("financial_status") == "paid":
-			create_sales_invoice(order, setting, so)
+			enqueue_order_stage("Sales Invoice", order, so.name)
 
 		if order.get("fulfillments"):
-			create_delivery_note(order, setting, so)
+			enqueue_order_stage("Delivery Note", order, so.name)
 
 
 def create_sales_order(shopify_order, setting, company=None, shipping_info=None):
@@ -113,14 +200,16 @@ def create_sales_order(shopify_order, setting, company=None, shipping_info=None)
 	if not customer:
 		frappe.throw("Default Customer is not set in Shopify Settings. Please configure it first.")
 
-	so = frappe.db.get_value("Sales Order", {ORDER_ID_FIELD: shopify_order.get("id")}, "name")
+	so = frappe.db.get_value("Sales Order", {ORDER_ID_FIELD: cstr(shopify_order.get("id"))}, "name")
 
 	if not so:
+		item_codes = get_item_codes(shopify_order.get("line_items"))
 		items = get_order_items(
 			shopify_order.get("line_items"),
 			setting,
 			getdate(shopify_order.get("created_at")),
 			taxes_inclusive=shopify_order.get("taxes_included"),
+			item_codes=item_codes,
 		)
 
 		if not items:
@@ -139,7 +228,7 @@ def create_sales_order(shopify_order, setting, company=None, shipping_info=None)
 		if not shipping_info:
 			shipping_info = _extract_shipping_info(shopify_order)
 
-		taxes = get_order_taxes(shopify_order, setting, items)
+		taxes = get_order_taxes(shopify_order, setting, items, item_codes=item_codes)
 		so = frappe.get_doc(
 			{
 				"doctype": "Sales Order",
@@ -178,7 +267,10 @@ def create_sales_order(shopify_order, setting, company=None, shipping_info=None)
 	return so
 
 
-def get_order_items(order_items, setting, delivery_date, taxes_inclusive):
+def get_order_items(order_items, setting, delivery_date, taxes_inclusive, item_codes=None):
+	if item_codes is None:
+		item_codes = get_item_codes(order_items)
+
 	items = []
 	all_product_exists = True
 	product_not_exists = []
@@ -192,7 +284,7 @@ def get_order_items(order_items, setting, delivery_date, taxes_inclusive):
 			continue
 
 		if all_product_exists:
-			item_code = get_item_code(shopify_item)
+			item_code = get_item_code(shopify_item, item_codes)
 			items.append(
 				{
 					"item_code": item_code,
@@ -235,12 +327,14 @@ def _get_total_discount(line_item) -> float:
 	return sum(flt(discount.get("amount")) for discount in discount_allocations)
 
 
-def get_order_taxes(shopify_order, setting, items):
+def get_order_taxes(shopify_order, setting, items, item_codes=None):
 	taxes = []
 	line_items = shopify_order.get("line_items")
+	if item_codes is None:
+		item_codes = get_item_codes(line_items)
 
 	for line_item in line_items:
-		item_code = get_item_code(line_item)
+		item_code = get_item_code(line_item, item_codes)
 		for tax in line_item.get("tax_lines"):
 			taxes.append(
 				{
@@ -303,15 +397,12 @@ def consolidate_order_taxes(taxes):
 
 def get_tax_account_head(tax, charge_type: Literal["shipping", "sales_tax"] | None = None):
 	tax_title = str(tax.get("title"))
+	tax_accounts = get_tax_accounts()
 
-	tax_account = frappe.db.get_value(
-		"Shopify Tax Account",
-		{"parent": SETTING_DOCTYPE, "shopify_tax": tax_title},
-		"tax_account",
-	)
+	tax_account = tax_accounts["accounts"].get(tax_title, {}).get("tax_account")
 
 	if not tax_account and charge_type:
-		tax_account = frappe.db.get_single_value(SETTING_DOCTYPE, DEFAULT_TAX_FIELDS[charge_type])
+		tax_account = tax_accounts["defaults"].get(charge_type)
 
 	if not tax_account:
 		frappe.throw(_("Tax Account not specified for Shopify Tax {0}").format(tax.get("title")))
@@ -320,15 +411,39 @@ def get_tax_account_head(tax, charge_type: Literal["shipping", "sales_tax"] | No
 
 
 def get_tax_account_description(tax):
-	tax_title = tax.get("title")
+	tax_title = str(tax.get("title"))
+
+	return get_tax_accounts()["accounts"].get(tax_title, {}).get("tax_description")
+
+
+def get_tax_accounts() -> dict:
+	"""Get mapping of shopify tax title to tax account and default tax accounts.
+
+	Mapping is loaded once and cached till Shopify Setting is saved again."""
+	return frappe.cache().get_value(TAX_ACCOUNTS_CACHE_KEY, generator=_load_tax_accounts)
+
 
-	tax_description = frappe.db.get_value(
+def _load_tax_accounts() -> dict:
+	tax_accounts = frappe.get_all(
 		"Shopify Tax Account",
-		{"parent": SETTING_DOCTYPE, "shopify_tax": tax_title},
-		"tax_description",
+		filters={"parent": SETTING_DOCTYPE, "parenttype": SETTING_DOCTYPE},
+		fields=["shopify_tax", "tax_account", "tax_description"],
 	)
 
-	return tax_description
+	return {
+		"accounts": {
+			d.shopify_tax: {"tax_account": d.tax_account, "tax_description": d.tax_description}
+			for d in tax_accounts
+		},
+		"defaults": {
+			charge_type: frappe.db.get_single_value(SETTING_DOCTYPE, fieldname)
+			for charge_type, fieldname in DEFAULT_TAX_FIELDS.items()
+		},
+	}
+
+
+def clear_tax_accounts_cache() -> None:
+	frappe.cache().delete_value(TAX_ACCOUNTS_CACHE_KEY)
 
 
 def update_taxes_with_shipping_lines(taxes, shipping_lines, setting, items, taxes_inclusive=False):
@@ -413,7 +528,7 @@ def cancel_order(payload, request_id=None):
 	order = payload
 
 	try:
-		order_id = order["id"]
+		order_id = cstr(order["id"])
 		order_status = order["financial_status"]
 
 		sales_order = get_sales_order(order_id)
@@ -442,36 +557,40 @@ def cancel_order(payload, request_id=None):
 		create_shopify_log(status="Success")
 
 
+@single_instance(OLD_ORDERS_SYNC_LEASE)
 @temp_shopify_session
 def sync_old_orders():
 	shopify_setting = frappe.get_cached_doc(SETTING_DOCTYPE)
 	if not cint(shopify_setting.sync_old_orders):
 		return
 
-	orders = _fetch_old_orders(shopify_setting.old_orders_from, shopify_setting.old_orders_to)
+	# local import to avoid circular dependencies
+	from ecommerce_integrations.shopify.backfill import run_backfill
 
-	for order in orders:
-		log = create_shopify_log(
-			method=EVENT_MAPPER["orders/create"], request_data=json.dumps(order), make_new=True
-		)
-		sync_sales_order(order, request_id=log.name)
+	# orders are synced by parallel jobs, this only starts or resumes them.
+	run_backfill(shopify_setting)
 
-	shopify_setting = frappe.get_doc(SETTING_DOCTYPE)
-	shopify_setting.sync_old_orders = 0
-	shopify_setting.save()
 
+def _fetch_old_orders(from_time, to_time, since_id=0):
+	"""Fetch all shopify orders in specified range and return an iterator on fetched orders.
 
-def _fetch_old_orders(from_time, to_time):
-	"""Fetch all shopify orders in specified range and return an iterator on fetched orders."""
+	Orders are fetched in ascending order of id, `since_id` can be used to resume after last fetched order.
+	Next page of orders is fetched while current page is being synced, or all orders are exported by a
+	bulk operation if it's enabled in setting."""
+	if cint(frappe.db.get_single_value(SETTING_DOCTYPE, "use_bulk_operations")):
+		yield from export_orders(from_time, to_time, since_id=since_id)
+		return
 
 	from_time = get_datetime(from_time).astimezone().isoformat()
 	to_time = get_datetime(to_time).astimezone().isoformat()
-	orders_iterator = PaginatedIterator(
-		Order.find(created_at_min=from_time, created_at_max=to_time, limit=250)
-	)
 
-	for orders in orders_iterator:
-		for order in orders:
-			# Using generator instead of fetching all at once is better for
-			# avoiding rate limits and reducing resource usage.
-			yield order.to_dict()
+	def fetch_page(since_id):
+		orders = Order.find(
+			created_at_min=from_time, created_at_max=to_time, since_id=since_id, limit=OLD_ORDERS_PAGE_SIZE
+		)
+		next_since_id = orders[-1].id if len(orders) == OLD_ORDERS_PAGE_SIZE else None
+		return [order.to_dict() for order in orders], next_since_id
+
+	with PagePrefetcher(fetch_page, cursor=since_id) as pages:
+		for orders in pages:
+			yield from orders
@@ -1,17 +1,23 @@
 from time import process_time
 
 import frappe
+from frappe import _
 from frappe.exceptions import UniqueValidationError
+from frappe.utils import cint
 from shopify.resources import Product
 
+from ecommerce_integrations.controllers.scheduling import get_lease, single_instance
 from ecommerce_integrations.ecommerce_integrations.doctype.ecommerce_item import ecommerce_item
+from ecommerce_integrations.shopify.bulk import export_products
 from ecommerce_integrations.shopify.connection import temp_shopify_session
-from ecommerce_integrations.shopify.constants import MODULE_NAME
+from ecommerce_integrations.shopify.constants import MODULE_NAME, PRODUCT_IMPORT_LEASE, SETTING_DOCTYPE
+from ecommerce_integrations.shopify.paginator import PagePrefetcher, collection_page_fetcher
 from ecommerce_integrations.shopify.product import ShopifyProduct
 
 # constants
 SYNC_JOB_NAME = "shopify.job.sync.all.products"
 REALTIME_KEY = "shopify.key.sync.all.products"
+PAGE_SIZE = 100
 
 
 @frappe.whitelist()
@@ -118,6 +124,9 @@ def is_synced(product):
 
 @frappe.whitelist()
 def import_all_products():
+	if get_lease(PRODUCT_IMPORT_LEASE):
+		frappe.throw(_("Product import is already running."))
+
 	frappe.enqueue(
 		queue_sync_all_products,
 		queue="long",
@@ -126,6 +135,8 @@ def import_all_products():
 	)
 
 
+@single_instance(PRODUCT_IMPORT_LEASE)
+@temp_shopify_session
 def queue_sync_all_products(*args, **kwargs):
 	start_time = process_time()
 
@@ -135,44 +146,61 @@ def queue_sync_all_products(*args, **kwargs):
 	if counts["shopifyCount"] < counts["syncedCount"]:
 		publish("⚠ Shopify has less products than ERPNext.")
 
-	_sync = True
-	collection = _fetch_products_from_shopify(limit=100)
 	savepoint = "shopify_product_sync"
-	while _sync:
-		for product in collection:
+	for products in _get_product_pages():
+		for product in products:
+			product_id = product["id"]
 			try:
-				publish(f"Syncing product {product.id}", br=False)
+				publish(f"Syncing product {product_id}", br=False)
 				frappe.db.savepoint(savepoint)
-				if is_synced(product.id):
-					publish(f"Product {product.id} already synced. Skipping...")
+				if is_synced(product_id):
+					publish(f"Product {product_id} already synced. Skipping...")
 					continue
 
-				shopify_product = ShopifyProduct(product.id)
-				shopify_product.sync_product()
+				shopify_product = ShopifyProduct(product_id)
+				shopify_product._make_item(product)
 
-				publish(f"✅ Synced Product {product.id}", synced=True)
+				publish(f"✅ Synced Product {product_id}", synced=True)
 
 			except UniqueValidationError as e:
-				publish(f"❌ Error Syncing Product {product.id} : {e!s}", error=True)
+				publish(f"❌ Error Syncing Product {product_id} : {e!s}", error=True)
 				frappe.db.rollback(save_point=savepoint)
 				continue
 
 			except Exception as e:
-				publish(f"❌ Error Syncing Product {product.id} : {e!s}", error=True)
+				publish(f"❌ Error Syncing Product {product_id} : {e!s}", error=True)
 				frappe.db.rollback(save_point=savepoint)
 				continue
 
-		if collection.has_next_page():
-			frappe.db.commit()  # prevents too many write request error
-			collection = _fetch_products_from_shopify(from_=collection.next_page_url)
-		else:
-			_sync = False
+		frappe.db.commit()  # prevents too many write request error
 
 	end_time = process_time()
 	publish(f"🎉 Done in {end_time - start_time}s", done=True)
 	return True
 
 
+def _get_product_pages():
+	"""Yield pages of products as dicts of REST `Product` resource.
+
+	Products are exported by a bulk operation if it's enabled in setting, otherwise next page of
+	products is fetched while current page is being synced."""
+	if cint(frappe.db.get_single_value(SETTING_DOCTYPE, "use_bulk_operations")):
+		products = []
+		for product in export_products():
+			products.append(product)
+			if len(products) == PAGE_SIZE:
+				yield products
+				products = []
+
+		if products:
+			yield products
+		return
+
+	with PagePrefetcher(collection_page_fetcher(Product, limit=PAGE_SIZE)) as pages:
+		for products in pages:
+			yield [product.to_dict() for product in products]
+
+
 def publish(message, synced=False, error=False, done=False, br=True):
 	frappe.publish_realtime(
 		REALTIME_KEY,
@@ -0,0 +1,111 @@
+"""Iteration over pages of Shopify resources, with following pages fetched in background.
+
+Fetching of page N+1 overlaps with processing of page N, instead of waiting for the network after
+every page. E.g.
+
+	def fetch_page(since_id):
+		orders = Order.find(since_id=since_id, limit=250)
+		return orders, (orders[-1].id if len(orders) == 250 else None)
+
+	with PagePrefetcher(fetch_page, cursor=0) as pages:
+		for orders in pages:
+			...
+"""
+
+import queue
+import threading
+from collections.abc import Callable, Iterator
+from typing import Any
+
+from ecommerce_integrations.shopify.connection import (
+	activate_session_in_thread,
+	get_current_session_details,
+)
+
+FetchPage = Callable[[Any], tuple[list, Any]]
+
+
+class PagePrefetcher:
+	"""Iterate over pages returned by `fetch_page` while following pages are fetched in a thread.
+
+	`fetch_page(cursor)` returns records of a page and cursor of next page, None for the last page.
+	At most `buffer_size` pages are fetched ahead of the page being processed. Fetching stops when
+	iteration is left early, errors raised by `fetch_page` are raised on iteration.
+
+	Thread uses shopify session of the caller but has no site context, `fetch_page` should only make
+	shopify API calls.
+	"""
+
+	def __init__(self, fetch_page: FetchPage, cursor=None, buffer_size: int = 2):
+		self.fetch_page = fetch_page
+		self.cursor = cursor
+
+		self._pages = queue.Queue(maxsize=buffer_size)
+		self._stopped = threading.Event()
+		self._thread = None
+
+	def __iter__(self) -> Iterator[list]:
+		if not self._thread:
+			self._thread = threading.Thread(
+				target=self._fetch_pages, args=get_current_session_details(), daemon=True
+			)
+			self._thread.start()
+
+		try:
+			while (page := self._pages.get()) is not _LAST_PAGE:
+				if isinstance(page, _FetchError):
+					raise page.exception
+				yield page
+		finally:
+			self.close()
+
+	def close(self) -> None:
+		"""Stop fetching pages, fetch in progress is discarded."""
+		self._stopped.set()
+
+	def _fetch_pages(self, *session_details) -> None:
+		cursor = self.cursor
+		try:
+			activate_session_in_thread(*session_details)
+			while not self._stopped.is_set():
+				records, cursor = self.fetch_page(cursor)
+				self._put(records)
+				if cursor is None:
+					break
+		except Exception as e:
+			self._put(_FetchError(e))
+		else:
+			self._put(_LAST_PAGE)
+
+	def _put(self, page) -> None:
+		# don't block forever on full buffer if consumer has stopped
+		while not self._stopped.is_set():
+			try:
+				self._pages.put(page, timeout=1)
+				return
+			except queue.Full:
+				continue
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+
+def collection_page_fetcher(resource, **kwargs) -> FetchPage:
+	"""Get `fetch_page` for resources paginated with links to next page, e.g. Product, Location."""
+
+	def fetch_page(next_page_url):
+		collection = resource.find(from_=next_page_url) if next_page_url else resource.find(**kwargs)
+		return list(collection), (collection.next_page_url if collection.has_next_page() else None)
+
+	return fetch_page
+
+
+class _FetchError:
+	def __init__(self, exception: Exception):
+		self.exception = exception
+
+
+_LAST_PAGE = object()
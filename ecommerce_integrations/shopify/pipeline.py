@@ -0,0 +1,269 @@
+"""Staged creation of documents for synced orders.
+
+Sales order is created by order webhook job, sales invoice, payment entry and delivery notes are
+then created by separate jobs (stages) so that slow postings of one order don't hold up webhooks of
+other orders. Every stage runs on its own queue and is retried with backoff on failure. Status of
+each stage is recorded in `stage_status` of the integration log of the order, log is marked as failed
+when a stage fails on all attempts and retrying the log enqueues failed stages again.
+
+Stages of an order hold the same lease as the job processing webhooks of the order, so they don't
+run along with each other or with `orders/paid` and `orders/fulfilled` webhooks of the order.
+
+Every stage has a dedicated queue so that stages get their own workers and one slow stage doesn't
+hold up others. Workers of these queues are configured in common_site_config.json, e.g.
+
+	"workers": {
+		"shopify_sales_invoice": {"timeout": 600},
+		"shopify_payment_entry": {"timeout": 600},
+		"shopify_delivery_note": {"timeout": 600}
+	}
+
+and started with `bench worker --queue shopify_sales_invoice` (or from Procfile / supervisor config).
+Stages are enqueued on "default" queue till workers of their queue are configured. Queue of a stage
+can also be changed from site config:
+
+	"shopify_order_stage_queues": {"Payment Entry": "shopify_payments"}
+
+Stages that are queued or waiting for retry are tracked per order in redis, see `get_pending_stages`.
+"""
+
+import json
+import time
+
+import frappe
+from frappe.utils import cstr, getdate, nowdate
+from frappe.utils.background_jobs import get_queues_timeout, get_redis_conn
+
+from ecommerce_integrations.controllers.scheduling import JobLease
+from ecommerce_integrations.shopify.constants import (
+	ORDER_EVENTS_LEASE,
+	ORDER_STAGE_RETRIES_KEY,
+	ORDER_STAGES_KEY,
+	SETTING_DOCTYPE,
+)
+from ecommerce_integrations.shopify.sequencing import enqueue_held_events
+from ecommerce_integrations.shopify.utils import create_shopify_log
+
+LOG_DOCTYPE = "Ecommerce Integration Log"
+
+ORDER_STAGES = {
+	"Sales Invoice": {"queue": "shopify_sales_invoice", "timeout": 600, "max_attempts": 3},
+	"Payment Entry": {"queue": "shopify_payment_entry", "timeout": 600, "max_attempts": 3},
+	"Delivery Note": {"queue": "shopify_delivery_note", "timeout": 600, "max_attempts": 3},
+}
+FALLBACK_QUEUE = "default"
+
+RETRY_DELAY = 60  # seconds, doubled on every attempt
+LEASE_WAIT_DELAY = 30  # seconds
+PENDING_STAGES_TTL = 24 * 60 * 60  # seconds, stages pending for longer were abandoned by killed workers
+
+
+def enqueue_order_stage(
+	stage: str, order: dict, sales_order: str, attempt: int = 1, delay: int = 0, **kwargs
+) -> None:
+	"""Enqueue stage of order after current transaction is committed, or after `delay` seconds."""
+	request_id = kwargs.pop("request_id", None) or frappe.flags.request_id
+
+	update_stage_status(request_id, stage, "Queued", attempt=attempt, kwargs=kwargs)
+	_set_stage_pending(order, stage, True)
+	job = {
+		"stage": stage,
+		"order": order,
+		"sales_order": sales_order,
+		"request_id": request_id,
+		"attempt": attempt,
+		**kwargs,
+	}
+
+	if delay:
+		# token keeps same job scheduled twice distinct in sorted set
+		entry = json.dumps({"job": job, "token": frappe.generate_hash(length=10)})
+		get_redis_conn().zadd(_get_retries_key(), {entry: time.time() + delay})
+	else:
+		_enqueue(job, enqueue_after_commit=True)
+
+
+def enqueue_due_order_stages() -> None:
+	"""Scheduled job to enqueue stages whose retry delay has passed."""
+	redis = get_redis_conn()
+	key = _get_retries_key()
+
+	for entry in redis.zrangebyscore(key, 0, time.time()):
+		# entry is enqueued only by the job that removes it
+		if redis.zrem(key, entry):
+			_enqueue(json.loads(entry)["job"])
+
+
+def retry_failed_stages(order: dict, sales_order: str, request_id: str) -> bool:
+	"""Enqueue failed stages of order again, returns False if no stage of the order had failed."""
+	stage_status = json.loads(frappe.db.get_value(LOG_DOCTYPE, request_id, "stage_status") or "{}")
+	failed_stages = {stage: d for stage, d in stage_status.items() if d.get("status") == "Error"}
+
+	for stage, details in failed_stages.items():
+		enqueue_order_stage(stage, order, sales_order, request_id=request_id, **(details.get("kwargs") or {}))
+
+	return bool(failed_stages)
+
+
+def get_pending_stages(order_ids: list[str]) -> dict[str, set[str]]:
+	"""Get stages that are queued or waiting for retry, by id of order."""
+	order_ids = [cstr(order_id) for order_id in order_ids]
+
+	pipe = get_redis_conn().pipeline(transaction=False)
+	for order_id in order_ids:
+		pipe.smembers(_get_pending_stages_key(order_id))
+
+	return {
+		order_id: {frappe.safe_decode(stage) for stage in stages}
+		for order_id, stages in zip(order_ids, pipe.execute(), strict=True)
+		if stages
+	}
+
+
+def run_order_stage(
+	stage: str, order: dict, sales_order: str, request_id: str | None = None, attempt: int = 1, **kwargs
+) -> None:
+	frappe.set_user("Administrator")
+	order_id = cstr(order["id"])
+
+	lease = JobLease(f"{ORDER_EVENTS_LEASE}:{order_id}")
+	if not lease.acquire():
+		# another stage or webhook of the order is being processed
+		enqueue_order_stage(
+			stage, order, sales_order, attempt, delay=LEASE_WAIT_DELAY, request_id=request_id, **kwargs
+		)
+		frappe.db.commit()
+		return
+
+	try:
+		_run_order_stage(stage, order, sales_order, request_id, attempt, **kwargs)
+	finally:
+		lease.release()
+
+	# webhooks received while stage was running were left by their job
+	enqueue_held_events(order_id)
+
+
+def _run_order_stage(stage, order, sales_order, request_id, attempt, **kwargs) -> None:
+	setting = frappe.get_cached_doc(SETTING_DOCTYPE)
+
+	try:
+		so = frappe.get_doc("Sales Order", sales_order)
+		STAGE_HANDLERS[stage](order, setting, so, request_id=request_id, **kwargs)
+	except Exception as e:
+		frappe.db.rollback()
+		if attempt < ORDER_STAGES[stage]["max_attempts"]:
+			delay = RETRY_DELAY * 2 ** (attempt - 1)
+			enqueue_order_stage(
+				stage, order, sales_order, attempt + 1, delay=delay, request_id=request_id, **kwargs
+			)
+		else:
+			error = frappe.get_traceback()
+			update_stage_status(request_id, stage, "Error", attempt=attempt, kwargs=kwargs, error=error)
+			_set_stage_pending(order, stage, False)
+			_mark_log_failed(request_id, stage, e)
+	else:
+		update_stage_status(request_id, stage, "Success", attempt=attempt)
+		_set_stage_pending(order, stage, False)
+
+	frappe.db.commit()
+
+
+def update_stage_status(request_id: str | None, stage: str, status: str, **details) -> None:
+	if not request_id:
+		return
+
+	# lock log as stages of an order can finish together
+	stage_status = frappe.db.get_value(LOG_DOCTYPE, request_id, "stage_status", for_update=True)
+	stage_status = json.loads(stage_status or "{}")
+	stage_status[stage] = {"status": status, **details}
+
+	frappe.db.set_value(
+		LOG_DOCTYPE,
+		request_id,
+		"stage_status",
+		json.dumps(stage_status, indent=1),
+		update_modified=False,
+	)
+
+
+def _mark_log_failed(request_id: str | None, stage: str, exception: Exception) -> None:
+	if not request_id:
+		return
+
+	frappe.flags.request_id = request_id
+	create_shopify_log(
+		status="Error", exception=exception, message=f"{stage} could not be created: {exception}"
+	)
+	frappe.flags.request_id = None
+
+
+def _create_sales_invoice(order, setting, so, request_id=None):
+	from ecommerce_integrations.shopify.invoice import create_sales_invoice
+
+	sales_invoice = create_sales_invoice(order, setting, so, make_payment=False)
+	if sales_invoice and sales_invoice.grand_total > 0:
+		enqueue_order_stage(
+			"Payment Entry", order, so.name, request_id=request_id, sales_invoice=sales_invoice.name
+		)
+
+
+def _create_payment_entry(order, setting, so, request_id=None, sales_invoice=None):
+	from ecommerce_integrations.shopify.invoice import make_payament_entry_against_sales_invoice
+
+	sales_invoice = frappe.get_doc("Sales Invoice", sales_invoice)
+	# retried stage could have already paid the invoice
+	if sales_invoice.outstanding_amount <= 0:
+		return
+
+	posting_date = getdate(order.get("created_at")) or nowdate()
+	make_payament_entry_against_sales_invoice(sales_invoice, setting, posting_date)
+
+
+def _create_delivery_note(order, setting, so, request_id=None):
+	from ecommerce_integrations.shopify.fulfillment import create_delivery_note
+
+	create_delivery_note(order, setting, so)
+
+
+def _set_stage_pending(order: dict, stage: str, pending: bool) -> None:
+	key = _get_pending_stages_key(order["id"])
+	redis = get_redis_conn()
+
+	if pending:
+		redis.sadd(key, stage)
+		redis.expire(key, PENDING_STAGES_TTL)
+	else:
+		redis.srem(key, stage)
+
+
+def _get_stage_queue(stage: str) -> str:
+	queue = (frappe.conf.get("shopify_order_stage_queues") or {}).get(stage) or ORDER_STAGES[stage]["queue"]
+	# dedicated queue is used only once its workers are configured, see module docstring
+	return queue if queue in get_queues_timeout() else FALLBACK_QUEUE
+
+
+def _enqueue(job: dict, enqueue_after_commit: bool = False) -> None:
+	frappe.enqueue(
+		run_order_stage,
+		queue=_get_stage_queue(job["stage"]),
+		timeout=ORDER_STAGES[job["stage"]]["timeout"],
+		enqueue_after_commit=enqueue_after_commit,
+		**job,
+	)
+
+
+def _get_pending_stages_key(order_id) -> str:
+	return f"{frappe.local.site}:{ORDER_STAGES_KEY}:{cstr(order_id)}"
+
+
+def _get_retries_key() -> str:
+	# job redis is shared by all sites on bench
+	return f"{frappe.local.site}:{ORDER_STAGE_RETRIES_KEY}"
+
+
+STAGE_HANDLERS = {
+	"Sales Invoice": _create_sales_invoice,
+	"Payment Entry": _create_payment_entry,
+	"Delivery Note": _create_delivery_note,
+}
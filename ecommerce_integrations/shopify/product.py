@@ -73,6 +73,7 @@ class ShopifyProduct:
 
 		else:
 			product_dict["variant_id"] = product_dict["variants"][0]["id"]
+			product_dict["inventory_item_id"] = product_dict["variants"][0].get("inventory_item_id")
 			self._create_item(product_dict, warehouse)
 
 	def _create_attribute(self, product_dict):
@@ -141,10 +142,16 @@ class ShopifyProduct:
 
 		integration_item_code = product_dict["id"]  # shopify product_id
 		variant_id = product_dict.get("variant_id", "")  # shopify variant_id if has variants
+		inventory_item_id = product_dict.get("inventory_item_id")
 		sku = item_dict["sku"]
 
 		if not _match_sku_and_link_item(
-			item_dict, integration_item_code, variant_id, variant_of=variant_of, has_variant=has_variant
+			item_dict,
+			integration_item_code,
+			variant_id,
+			variant_of=variant_of,
+			has_variant=has_variant,
+			inventory_item_id=inventory_item_id,
 		):
 			ecommerce_item.create_ecommerce_item(
 				MODULE_NAME,
@@ -154,6 +161,7 @@ class ShopifyProduct:
 				sku=sku,
 				variant_of=variant_of,
 				has_variants=has_variant,
+				inventory_item_id=inventory_item_id,
 			)
 
 	def _create_item_variants(self, product_dict, warehouse, attributes):
@@ -166,6 +174,7 @@ class ShopifyProduct:
 				shopify_item_variant = {
 					"id": product_dict.get("id"),
 					"variant_id": variant.get("id"),
+					"inventory_item_id": variant.get("inventory_item_id"),
 					"item_code": variant.get("id"),
 					"title": product_dict.get("title", "").strip() + "-" + variant.get("title"),
 					"product_type": product_dict.get("product_type"),
@@ -271,7 +280,9 @@ def _get_item_image(product_dict):
 	return None
 
 
-def _match_sku_and_link_item(item_dict, product_id, variant_id, variant_of=None, has_variant=False) -> bool:
+def _match_sku_and_link_item(
+	item_dict, product_id, variant_id, variant_of=None, has_variant=False, inventory_item_id=None
+) -> bool:
 	"""Tries to match new item with existing item using Shopify SKU == item_code.
 
 	Returns true if matched and linked.
@@ -292,6 +303,7 @@ def _match_sku_and_link_item(item_dict, product_id, variant_id, variant_of=None,
 					"has_variants": 0,
 					"variant_id": cstr(variant_id),
 					"sku": sku,
+					"inventory_item_id": cstr(inventory_item_id),
 				}
 			)
 
@@ -313,19 +325,31 @@ def create_items_if_not_exist(order):
 			product.sync_product()
 
 
-def get_item_code(shopify_item):
+def get_item_code(shopify_item, item_codes=None):
 	"""Get item code using shopify_item dict.
 
-	Item should contain both product_id and variant_id."""
+	Item should contain both product_id and variant_id.
+	`item_codes` returned by `get_item_codes` can be passed to avoid querying for each item."""
 
-	item = ecommerce_item.get_erpnext_item(
-		integration=MODULE_NAME,
-		integration_item_code=shopify_item.get("product_id"),
-		variant_id=shopify_item.get("variant_id"),
-		sku=shopify_item.get("sku"),
+	if item_codes is None:
+		item_codes = get_item_codes([shopify_item])
+
+	return item_codes.get(_get_item_key(shopify_item))
+
+
+def get_item_codes(shopify_items) -> dict[tuple[str, str, str], str]:
+	"""Get item codes of all line items of an order or fulfillment using a single query."""
+	return ecommerce_item.get_erpnext_item_codes(
+		MODULE_NAME, [_get_item_key(shopify_item) for shopify_item in shopify_items]
+	)
+
+
+def _get_item_key(shopify_item) -> tuple[str, str, str]:
+	return (
+		cstr(shopify_item.get("product_id")),
+		cstr(shopify_item.get("variant_id")),
+		cstr(shopify_item.get("sku")),
 	)
-	if item:
-		return item.item_code
 
 
 @temp_shopify_session
@@ -423,6 +447,9 @@ def upload_erpnext_item(doc, method=None):
 						"integration_item_code": str(product.id),
 						"variant_id": "" if d.has_variants else str(product.variants[0].id),
 						"sku": "" if d.has_variants else str(product.variants[0].sku),
+						"inventory_item_id": ""
+						if d.has_variants
+						else cstr(getattr(product.variants[0], "inventory_item_id", "")),
 						"has_variants": d.has_variants,
 						"variant_of": d.variant_of,
 					}
@@ -492,6 +519,7 @@ def map_erpnext_variant_to_shopify_variant(shopify_product: Product, erpnext_ite
 							"integration_item_code": str(shopify_product.id),
 							"variant_id": variant_product_id,
 							"sku": str(variant.sku),
+							"inventory_item_id": cstr(getattr(variant, "inventory_item_id", "")),
 							"variant_of": erpnext_item.variant_of,
 						}
 					).insert()
@@ -0,0 +1,152 @@
+"""Reconciliation of orders missed by webhooks.
+
+Orders updated on Shopify since the last run (watermark) are compared with synced Sales Orders and
+events of orders that are missing or out of date are processed as if their webhooks were received.
+Fulfillments are compared with delivery notes by id and documents that are still being created by
+order pipeline aren't treated as missed.
+Orders updated in last few minutes are left for the next run, their webhooks are probably on the way.
+"""
+
+from collections import defaultdict
+
+import frappe
+from frappe.utils import add_to_date, cint, cstr, flt, get_datetime, now_datetime
+from shopify.resources import Order
+
+from ecommerce_integrations.controllers.scheduling import single_instance
+from ecommerce_integrations.shopify.connection import process_request, temp_shopify_session
+from ecommerce_integrations.shopify.constants import (
+	FULLFILLMENT_ID_FIELD,
+	ORDER_ID_FIELD,
+	ORDER_RECONCILIATION_LEASE,
+	ORDER_STATUS_FIELD,
+	SETTING_DOCTYPE,
+)
+from ecommerce_integrations.shopify.paginator import PagePrefetcher
+from ecommerce_integrations.shopify.pipeline import get_pending_stages
+
+PAGE_SIZE = 250
+RECONCILIATION_LAG = 5  # minutes
+INITIAL_LOOKBACK = 1  # days
+
+
+@single_instance(ORDER_RECONCILIATION_LEASE)
+@temp_shopify_session
+def reconcile_orders() -> None:
+	setting = frappe.get_cached_doc(SETTING_DOCTYPE)
+	if not cint(setting.reconcile_missed_orders):
+		return
+
+	updated_till = add_to_date(now_datetime(), minutes=-RECONCILIATION_LAG)
+	updated_from = get_datetime(
+		frappe.db.get_single_value(SETTING_DOCTYPE, "orders_reconciled_till")
+		or add_to_date(updated_till, days=-INITIAL_LOOKBACK)
+	)
+
+	for orders in _fetch_updated_orders(updated_from, updated_till):
+		for order, event in get_missed_events(orders, setting):
+			process_request(order, event)
+		frappe.db.commit()
+
+	# watermark is moved only after all orders are checked, failed run is repeated from same point.
+	frappe.db.set_single_value(SETTING_DOCTYPE, "orders_reconciled_till", updated_till, update_modified=False)
+
+
+def get_missed_events(orders: list[dict], setting) -> list[tuple[dict, str]]:
+	"""Get events of orders that are not reflected in ERPNext yet, using single lookup of Sales Orders,
+	Delivery Notes and pending stages for all orders."""
+	order_ids = [cstr(order["id"]) for order in orders]
+	sales_orders = _get_sales_orders(order_ids)
+	synced_fulfillments = _get_synced_fulfillments(order_ids)
+	pending_stages = get_pending_stages(order_ids)
+
+	events = []
+	for order in orders:
+		order_id = cstr(order["id"])
+		so = sales_orders.get(order_id)
+		if not so:
+			if not order.get("cancelled_at"):
+				events.append((order, "orders/create"))
+			continue
+
+		# invoices, delivery notes and cancellation are only synced for submitted orders
+		if so.docstatus != 1:
+			continue
+
+		if order.get("cancelled_at"):
+			if so.get(ORDER_STATUS_FIELD) != order.get("financial_status"):
+				events.append((order, "orders/cancelled"))
+			continue
+
+		# stages still being created by order pipeline aren't missed
+		stages = pending_stages.get(order_id, set())
+
+		if (
+			order.get("financial_status") == "paid"
+			and not flt(so.per_billed)
+			and cint(setting.sync_sales_invoice)
+			and not stages & {"Sales Invoice", "Payment Entry"}
+		):
+			events.append((order, "orders/paid"))
+
+		fulfillment_ids = {cstr(d["id"]) for d in order.get("fulfillments") or []}
+		if (
+			fulfillment_ids - synced_fulfillments.get(order_id, set())
+			and cint(setting.sync_delivery_note)
+			and "Delivery Note" not in stages
+		):
+			event = (
+				"orders/fulfilled"
+				if order.get("fulfillment_status") == "fulfilled"
+				else "orders/partially_fulfilled"
+			)
+			events.append((order, event))
+
+	return events
+
+
+def _get_sales_orders(order_ids: list[str]) -> dict[str, dict]:
+	return {
+		so[ORDER_ID_FIELD]: so
+		for so in frappe.get_all(
+			"Sales Order",
+			filters={ORDER_ID_FIELD: ("in", order_ids)},
+			fields=[ORDER_ID_FIELD, "docstatus", "per_billed", ORDER_STATUS_FIELD],
+			order_by="docstatus desc",  # amended orders take precedence over cancelled ones
+		)
+	}
+
+
+def _get_synced_fulfillments(order_ids: list[str]) -> dict[str, set[str]]:
+	"""Get ids of fulfillments that have delivery notes, including cancelled ones as they aren't recreated."""
+	synced_fulfillments = defaultdict(set)
+	for dn in frappe.get_all(
+		"Delivery Note",
+		filters={ORDER_ID_FIELD: ("in", order_ids)},
+		fields=[ORDER_ID_FIELD, FULLFILLMENT_ID_FIELD],
+	):
+		synced_fulfillments[dn[ORDER_ID_FIELD]].add(cstr(dn[FULLFILLMENT_ID_FIELD]))
+
+	return synced_fulfillments
+
+
+def _fetch_updated_orders(from_time, to_time, since_id=0):
+	"""Fetch orders updated in specified range, yields one page of orders at a time."""
+	from_time = get_datetime(from_time).astimezone().isoformat()
+	to_time = get_datetime(to_time).astimezone().isoformat()
+
+	def fetch_page(since_id):
+		orders = Order.find(
+			updated_at_min=from_time,
+			updated_at_max=to_time,
+			status="any",
+			since_id=since_id,
+			limit=PAGE_SIZE,
+		)
+		next_since_id = orders[-1].id if len(orders) == PAGE_SIZE else None
+		return [order.to_dict() for order in orders], next_since_id
+
+	with PagePrefetcher(fetch_page, cursor=since_id) as pages:
+		for orders in pages:
+			if orders:
+				yield orders
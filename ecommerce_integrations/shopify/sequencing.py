@@ -0,0 +1,230 @@
+"""Per order sequencing of order webhooks.
+
+Shopify sends `orders/create`, `orders/paid`, `orders/fulfilled` and `orders/cancelled` as separate
+webhooks which can arrive together or out of order. Events of an order are kept in a redis hash
+and processed one at a time by a job that holds a lease for the order, in the order in which
+they happen on Shopify. Newer event of same kind supersedes the pending one as every order webhook
+contains complete order. Follow up events are held till sales order is created, also when they arrive
+before `orders/create` of the order, for at most `CREATE_EVENT_TIMEOUT`.
+"""
+
+import json
+import time
+
+import frappe
+from frappe.utils import cstr
+from frappe.utils.background_jobs import get_redis_conn
+
+from ecommerce_integrations.controllers.scheduling import JobLease
+from ecommerce_integrations.shopify.constants import (
+	EVENT_MAPPER,
+	ORDER_EVENTS_KEY,
+	ORDER_EVENTS_LEASE,
+	ORDER_ID_FIELD,
+	PENDING_ORDERS_KEY,
+	SETTING_DOCTYPE,
+)
+from ecommerce_integrations.shopify.utils import create_shopify_log
+
+SEQUENCED_EVENTS = [
+	"orders/create",
+	"orders/paid",
+	"orders/fulfilled",
+	"orders/partially_fulfilled",
+	"orders/cancelled",
+]
+
+# order in which events are processed, partial and complete fulfillment map to same method
+EVENT_SEQUENCE = list(dict.fromkeys(EVENT_MAPPER[event] for event in SEQUENCED_EVENTS))
+CREATE_ORDER_METHOD = EVENT_MAPPER["orders/create"]
+
+# how long follow up events wait for a sales order queued for batch sync
+ORDER_CREATION_TIMEOUT = 60 * 60
+# how long follow up events wait for `orders/create` webhook that hasn't arrived yet
+CREATE_EVENT_TIMEOUT = 15 * 60
+
+# store event unless a newer one of same kind is pending, returns the event that was superseded.
+_QUEUE_EVENT_SCRIPT = """
+local pending = redis.call("hget", KEYS[1], ARGV[1])
+if pending and cjson.decode(pending).updated_at > cjson.decode(ARGV[2]).updated_at then
+	return ARGV[2]
+end
+redis.call("hset", KEYS[1], ARGV[1], ARGV[2])
+redis.call("sadd", KEYS[2], ARGV[3])
+return pending
+"""
+
+# remove processed event unless it was superseded while processing
+_REMOVE_EVENT_SCRIPT = """
+if redis.call("hget", KEYS[1], ARGV[1]) == ARGV[2] then
+	redis.call("hdel", KEYS[1], ARGV[1])
+end
+if redis.call("hlen", KEYS[1]) == 0 then
+	redis.call("srem", KEYS[2], ARGV[3])
+end
+"""
+
+
+def queue_order_event(order: dict, event: str, request_id: str) -> None:
+	"""Queue order webhook to be processed after earlier events of same order."""
+	# local import to avoid circular dependencies
+	from ecommerce_integrations.shopify.order import queue_order_for_batch_sync
+
+	order_id = cstr(order["id"])
+
+	if event == "orders/create" and frappe.get_cached_doc(SETTING_DOCTYPE).order_sync_batch_size:
+		get_redis_conn().set(_get_creating_order_key(order_id), 1, ex=ORDER_CREATION_TIMEOUT)
+		queue_order_for_batch_sync(request_id)
+		return
+
+	method = EVENT_MAPPER[event]
+	entry = json.dumps({"request_id": request_id, "updated_at": cstr(order.get("updated_at"))})
+
+	superseded = get_redis_conn().eval(
+		_QUEUE_EVENT_SCRIPT,
+		2,
+		_get_order_events_key(order_id),
+		_get_pending_orders_key(),
+		method,
+		entry,
+		order_id,
+	)
+	if superseded:
+		_mark_superseded(json.loads(superseded)["request_id"])
+
+	enqueue_order_events(order_id)
+
+
+def enqueue_order_events(order_id: str) -> None:
+	frappe.enqueue(
+		process_order_events,
+		queue="short",
+		timeout=600,
+		job_id=f"{ORDER_EVENTS_KEY}:{order_id}",
+		deduplicate=True,
+		enqueue_after_commit=True,
+		order_id=order_id,
+	)
+
+
+def release_held_events(order_id: str) -> None:
+	"""Called after sales order is synced by batch consumer, starts processing held events."""
+	order_id = cstr(order_id)
+	_mark_order_created(order_id)
+	enqueue_held_events(order_id)
+
+
+def enqueue_held_events(order_id: str) -> None:
+	"""Start processing events of order that were left while its lease was held by someone else."""
+	if get_redis_conn().exists(_get_order_events_key(cstr(order_id))):
+		enqueue_order_events(cstr(order_id))
+
+
+def process_order_events(order_id: str) -> None:
+	lease = JobLease(f"{ORDER_EVENTS_LEASE}:{order_id}")
+	if not lease.acquire():
+		# some other job is processing this order, it will pick up new events too
+		return
+
+	try:
+		while next_event := _get_next_event(order_id):
+			method, entry = next_event
+			_process_event(method, json.loads(entry)["request_id"])
+			if method == CREATE_ORDER_METHOD:
+				_mark_order_created(order_id)
+			get_redis_conn().eval(
+				_REMOVE_EVENT_SCRIPT,
+				2,
+				_get_order_events_key(order_id),
+				_get_pending_orders_key(),
+				method,
+				entry,
+				order_id,
+			)
+	finally:
+		lease.release()
+
+
+def process_pending_order_events() -> None:
+	"""Scheduled job to pick up orders whose events were left unprocessed, e.g. by a killed worker."""
+	for order_id in get_redis_conn().smembers(_get_pending_orders_key()):
+		enqueue_order_events(frappe.safe_decode(order_id))
+
+
+def _get_next_event(order_id: str) -> tuple[str, str] | None:
+	pending = {
+		frappe.safe_decode(method): frappe.safe_decode(entry)
+		for method, entry in get_redis_conn().hgetall(_get_order_events_key(order_id)).items()
+	}
+
+	for method in EVENT_SEQUENCE:
+		if method not in pending:
+			continue
+		if method != CREATE_ORDER_METHOD and _is_waiting_for_order(order_id):
+			return
+		return method, pending[method]
+
+
+def _is_waiting_for_order(order_id: str) -> bool:
+	"""Check if follow up events of order should wait for its sales order to be created."""
+	redis = get_redis_conn()
+	if redis.exists(_get_created_order_key(order_id)):
+		return False  # create event was processed, even if it failed there is nothing to wait for
+
+	if frappe.db.exists("Sales Order", {ORDER_ID_FIELD: order_id}):
+		return False
+
+	# sales order queued for batch sync
+	if redis.exists(_get_creating_order_key(order_id)):
+		return True
+
+	# create webhook not received yet, e.g. delivered after paid webhook. Events are picked up by
+	# `process_pending_order_events` after the timeout even if it never arrives.
+	waiting_key = _get_waiting_order_key(order_id)
+	redis.set(waiting_key, time.time(), nx=True, ex=2 * CREATE_EVENT_TIMEOUT)
+	return time.time() - float(redis.get(waiting_key) or 0) < CREATE_EVENT_TIMEOUT
+
+
+def _mark_order_created(order_id: str) -> None:
+	redis = get_redis_conn()
+	redis.set(_get_created_order_key(order_id), 1, ex=ORDER_CREATION_TIMEOUT)
+	redis.delete(_get_creating_order_key(order_id), _get_waiting_order_key(order_id))
+
+
+def _process_event(method: str, request_id: str) -> None:
+	log = frappe.db.get_value(
+		"Ecommerce Integration Log", request_id, ["status", "request_data"], as_dict=True
+	)
+	# log could have been retried or deleted in the meantime
+	if not log or log.status != "Queued":
+		return
+
+	frappe.db.commit()
+	frappe.get_attr(method)(json.loads(log.request_data), request_id=request_id)
+
+
+def _mark_superseded(request_id: str) -> None:
+	frappe.flags.request_id = request_id
+	create_shopify_log(status="Invalid", message="Superseded by a newer webhook for same order, not synced")
+	frappe.flags.request_id = None
+
+
+def _get_order_events_key(order_id: str) -> str:
+	return f"{frappe.local.site}:{ORDER_EVENTS_KEY}:{order_id}"
+
+
+def _get_creating_order_key(order_id: str) -> str:
+	return f"{frappe.local.site}:{ORDER_EVENTS_KEY}:creating:{order_id}"
+
+
+def _get_created_order_key(order_id: str) -> str:
+	return f"{frappe.local.site}:{ORDER_EVENTS_KEY}:created:{order_id}"
+
+
+def _get_waiting_order_key(order_id: str) -> str:
+	return f"{frappe.local.site}:{ORDER_EVENTS_KEY}:waiting:{order_id}"
+
+
+def _get_pending_orders_key() -> str:
+	# job redis is shared by all sites on bench
+	return f"{frappe.local.site}:{PENDING_ORDERS_KEY}"
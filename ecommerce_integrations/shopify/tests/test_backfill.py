@@ -0,0 +1,27 @@
+# Copyright (c) 2021, Frappe and Contributors
+# See LICENSE
+
+import unittest
+from itertools import pairwise
+from unittest.mock import patch
+
+from frappe.utils import add_to_date, get_datetime
+
+from ecommerce_integrations.shopify import backfill
+
+
+@patch.object(backfill, "_count_orders", return_value=0)
+class TestBackfill(unittest.TestCase):
+	def tearDown(self):
+		backfill.clear_backfill()
+
+	def test_shards_dont_overlap(self, count_orders):
+		shards = backfill._plan_shards("2021-01-01 00:00:00", "2021-01-02 00:00:01", 3)
+
+		ranges = [(get_datetime(d["from"]), get_datetime(d["to"])) for d in shards.values()]
+		self.assertEqual(ranges[0][0], get_datetime("2021-01-01 00:00:00"))
+		self.assertEqual(ranges[-1][1], get_datetime("2021-01-02 00:00:01"))
+
+		# next shard starts a second after previous one ends
+		for (_, shard_to), (next_from, _) in pairwise(ranges):
+			self.assertEqual(add_to_date(shard_to, seconds=1), next_from)
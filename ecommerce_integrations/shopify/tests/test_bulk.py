@@ -0,0 +1,207 @@
+# Copyright (c) 2021, Frappe and Contributors
+# See LICENSE
+
+import json
+import tempfile
+import unittest
+from contextlib import contextmanager
+from pathlib import Path
+from unittest.mock import patch
+
+from ecommerce_integrations.shopify import bulk
+
+PRODUCT_NODES = [
+	{
+		"id": "gid://shopify/Product/1",
+		"title": "T-Shirt",
+		"descriptionHtml": "<p>Cotton</p>",
+		"productType": "Apparel",
+		"vendor": "Frappe",
+		"options": [{"name": "Size", "values": ["S", "M"]}, {"name": "Color", "values": ["Red"]}],
+		"featuredImage": {"url": "https://cdn.shopify.com/t-shirt.png"},
+	},
+	{
+		"__typename": "ProductVariant",
+		"id": "gid://shopify/ProductVariant/11",
+		"title": "S / Red",
+		"sku": "TS-S-RED",
+		"price": "10.00",
+		"weight": 0.2,
+		"weightUnit": "KILOGRAMS",
+		"inventoryItem": {"id": "gid://shopify/InventoryItem/111"},
+		"selectedOptions": [{"name": "Color", "value": "Red"}, {"name": "Size", "value": "S"}],
+		"__parentId": "gid://shopify/Product/1",
+	},
+	{
+		"__typename": "ProductVariant",
+		"id": "gid://shopify/ProductVariant/12",
+		"title": "M / Red",
+		"sku": "TS-M-RED",
+		"price": "12.00",
+		"weight": 200,
+		"weightUnit": "GRAMS",
+		"inventoryItem": {"id": "gid://shopify/InventoryItem/112"},
+		"selectedOptions": [{"name": "Size", "value": "M"}, {"name": "Color", "value": "Red"}],
+		"__parentId": "gid://shopify/Product/1",
+	},
+	{
+		"id": "gid://shopify/Product/2",
+		"title": "Mug",
+		"options": [{"name": "Title", "values": ["Default Title"]}],
+	},
+]
+
+ORDER_NODES = [
+	{
+		"id": "gid://shopify/Order/5",
+		"name": "#1005",
+		"createdAt": "2021-04-15T12:29:03Z",
+		"taxesIncluded": False,
+		"displayFinancialStatus": "PARTIALLY_PAID",
+		"shippingAddress": {"firstName": "Jane", "lastName": "Doe", "city": "Mumbai"},
+		"taxLines": [],
+		"fulfillments": [
+			{"id": "gid://shopify/Fulfillment/7", "createdAt": "2021-04-16T10:00:00Z", "location": None}
+		],
+	},
+	{
+		"__typename": "LineItem",
+		"id": "gid://shopify/LineItem/51",
+		"name": "T-Shirt - S / Red",
+		"quantity": 2,
+		"sku": "TS-S-RED",
+		"product": {"id": "gid://shopify/Product/1"},
+		"variant": {"id": "gid://shopify/ProductVariant/11"},
+		"originalUnitPriceSet": {"shopMoney": {"amount": "10.0"}},
+		"taxLines": [{"title": "GST", "rate": 0.18, "priceSet": {"shopMoney": {"amount": "3.6"}}}],
+		"discountAllocations": [{"allocatedAmountSet": {"shopMoney": {"amount": "1.0"}}}],
+		"__parentId": "gid://shopify/Order/5",
+	},
+]
+
+FULFILLMENT_NODES = [
+	{
+		"id": "gid://shopify/Fulfillment/7",
+		"fulfillmentLineItems": {
+			"nodes": [
+				{
+					"id": "gid://shopify/FulfillmentLineItem/71",
+					"quantity": 1,
+					"lineItem": {
+						"id": "gid://shopify/LineItem/51",
+						"sku": "TS-S-RED",
+						"product": {"id": "gid://shopify/Product/1"},
+						"variant": {"id": "gid://shopify/ProductVariant/11"},
+					},
+				}
+			]
+		},
+	}
+]
+
+
+class TestBulkOperation(unittest.TestCase):
+	def test_export_products(self):
+		with self._serve(PRODUCT_NODES):
+			products = list(bulk.export_products())
+
+		self.assertEqual(len(products), 2)
+		product, mug = products
+
+		self.assertEqual(product["id"], "1")
+		self.assertEqual(product["body_html"], "<p>Cotton</p>")
+		self.assertEqual(product["image"], {"src": "https://cdn.shopify.com/t-shirt.png"})
+		self.assertEqual([v["id"] for v in product["variants"]], ["11", "12"])
+
+		variant = product["variants"][0]
+		self.assertEqual(variant["inventory_item_id"], "111")
+		self.assertEqual((variant["option1"], variant["option2"]), ("S", "Red"))
+		self.assertEqual((variant["weight"], variant["weight_unit"]), (0.2, "kg"))
+		self.assertEqual(mug["variants"], [])
+
+	def test_export_orders(self):
+		# line items of fulfillments are fetched by follow up query
+		with self._serve(ORDER_NODES, {"nodes": FULFILLMENT_NODES}) as execute_graphql:
+			(order,) = list(bulk.export_orders("2021-04-01", "2021-04-30", since_id=4))
+
+		self.assertIn("id:>4", execute_graphql.call_args_list[0].args[1]["query"])
+		self.assertEqual(execute_graphql.call_args.args[1], {"ids": ["gid://shopify/Fulfillment/7"]})
+
+		self.assertEqual(order["id"], "5")
+		self.assertEqual(order["financial_status"], "partially_paid")
+		self.assertEqual(order["shipping_address"]["first_name"], "Jane")
+
+		(line_item,) = order["line_items"]
+		self.assertEqual((line_item["product_id"], line_item["variant_id"]), ("1", "11"))
+		self.assertTrue(line_item["product_exists"])
+		self.assertEqual(line_item["price"], "10.0")
+		self.assertEqual(line_item["tax_lines"], [{"title": "GST", "rate": 0.18, "price": "3.6"}])
+		self.assertEqual(line_item["discount_allocations"], [{"amount": "1.0"}])
+
+		(fulfillment,) = order["fulfillments"]
+		self.assertEqual(fulfillment["order_id"], "5")
+		self.assertEqual(fulfillment["line_items"][0]["variant_id"], "11")
+		self.assertEqual(fulfillment["line_items"][0]["quantity"], 1)
+
+	def test_failed_bulk_operation(self):
+		responses = [
+			{
+				"bulkOperationRunQuery": {
+					"bulkOperation": {"id": "gid://shopify/BulkOperation/1"},
+					"userErrors": [],
+				}
+			},
+			{"node": {"status": "FAILED", "errorCode": "INTERNAL_SERVER_ERROR"}},
+		]
+
+		with patch.object(bulk, "execute_graphql", side_effect=responses):
+			self.assertRaises(Exception, bulk.run_bulk_query, bulk.PRODUCTS_BULK_QUERY)
+
+	def test_waits_for_running_bulk_operation(self):
+		busy = {
+			"bulkOperationRunQuery": {
+				"bulkOperation": None,
+				"userErrors": [
+					{
+						"field": None,
+						"message": "A bulk query operation for this app and shop is already in progress: "
+						"gid://shopify/BulkOperation/1.",
+					}
+				],
+			}
+		}
+
+		# query is started again after running operation is complete
+		with self._serve(PRODUCT_NODES, busy_responses=[busy, busy]) as execute_graphql:
+			products = list(bulk.export_products())
+
+		self.assertEqual(len(products), 2)
+		self.assertEqual(execute_graphql.call_count, 5)
+
+	def test_empty_result(self):
+		self.assertEqual(list(bulk.iter_bulk_results(None)), [])
+
+	@contextmanager
+	def _serve(self, nodes, *follow_up_responses, busy_responses=()):
+		"""Serve nodes as result file of a completed bulk operation from local file system."""
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			path = Path(tmp_dir) / "result.jsonl"
+			path.write_text("\n".join(json.dumps(d) for d in nodes) + "\n")
+
+			responses = [
+				*busy_responses,
+				{
+					"bulkOperationRunQuery": {
+						"bulkOperation": {"id": "gid://shopify/BulkOperation/1"},
+						"userErrors": [],
+					}
+				},
+				{"node": {"status": "RUNNING"}},
+				{"node": {"status": "COMPLETED", "url": path.as_uri()}},
+				*follow_up_responses,
+			]
+			with (
+				patch.object(bulk, "execute_graphql", side_effect=responses) as execute_graphql,
+				patch.object(bulk.time, "sleep"),
+			):
+				yield execute_graphql
@@ -1,9 +1,15 @@
 # Copyright (c) 2021, Frappe and Contributors
 # See LICENSE
 
+import json
+import time
 import unittest
+from http import HTTPStatus
+from unittest.mock import MagicMock, patch
 
 import frappe
+import requests
+from pyactiveresource.connection import ResourceNotFound
 from shopify.resources import Webhook
 from shopify.session import Session
 
@@ -11,6 +17,16 @@ from ecommerce_integrations.shopify import connection
 from ecommerce_integrations.shopify.constants import API_VERSION, SETTING_DOCTYPE
 
 
+def _make_response(status_code, headers=None, body=b"{}"):
+	response = requests.Response()
+	response.status_code = status_code
+	response.reason = HTTPStatus(status_code).phrase
+	response.headers.update(headers or {})
+	response.url = "https://test.myshopify.com/admin/api/products/1.json"
+	response._content = body
+	return response
+
+
 class TestShopifyConnection(unittest.TestCase):
 	@classmethod
 	def setUpClass(cls):
@@ -36,3 +52,79 @@ class TestShopifyConnection(unittest.TestCase):
 		with Session.temp(self.setting.shopify_url, API_VERSION, self.setting.get_password("password")):
 			for wh in Webhook.find():
 				self.assertNotEqual(wh.address, callback_url)
+
+	def test_duplicate_webhooks_are_skipped(self):
+		webhook_id = frappe.generate_hash()
+		duplicates = connection.get_webhook_stats()["duplicates"]
+
+		self.assertFalse(connection._is_duplicate_webhook(webhook_id))
+		self.assertTrue(connection._is_duplicate_webhook(webhook_id))
+		self.assertEqual(connection.get_webhook_stats()["duplicates"], duplicates + 1)
+
+		# failed processing should allow redelivery
+		connection._forget_webhook(webhook_id)
+		self.assertFalse(connection._is_duplicate_webhook(webhook_id))
+
+	def test_process_webhook_buffer(self):
+		payload = {"id": 1234}
+		connection.get_redis_conn().rpush(
+			connection._get_webhook_buffer_key(),
+			json.dumps({"event": "orders/create", "data": json.dumps(payload)}),
+		)
+
+		with patch.object(connection, "process_request") as process_request:
+			connection.process_webhook_buffer()
+
+		process_request.assert_called_once_with(payload, "orders/create")
+		self.assertEqual(connection.get_redis_conn().llen(connection._get_webhook_buffer_key()), 0)
+
+	def test_rate_limiter_reserves_bucket_for_interactive_calls(self):
+		shopify_url = f"{frappe.generate_hash()}.myshopify.com"
+		background = connection.APIRateLimiter(shopify_url, interactive=False)
+		interactive = connection.APIRateLimiter(shopify_url, interactive=True)
+
+		background.update(frappe._dict(headers={background.CALL_LIMIT_HEADER: "30/40"}))
+
+		with patch.object(connection.time, "sleep") as sleep:
+			interactive.acquire()
+			sleep.assert_not_called()
+
+		with patch.object(connection.time, "sleep", wraps=time.sleep) as sleep:
+			background.acquire()
+			sleep.assert_called()
+
+		frappe.cache().delete(background.key)
+
+	def test_auth_details_are_cached_until_setting_changes(self):
+		setting = frappe._dict(shopify_url="test.myshopify.com", modified="2021-01-01 00:00:00")
+		setting.get_password = lambda fieldname: frappe.generate_hash()
+
+		auth_details = connection._get_auth_details(setting)
+		self.assertEqual(connection._get_auth_details(setting), auth_details)
+
+		setting.modified = "2021-01-02 00:00:00"
+		self.assertNotEqual(connection._get_auth_details(setting), auth_details)
+
+		connection._auth_details_cache.clear()
+
+	def test_error_responses_of_pooled_connection(self):
+		api_connection = connection.ShopifyAPIConnection(
+			"https://test.myshopify.com/admin/api", limiter=MagicMock()
+		)
+
+		with (
+			patch.object(connection, "_get_http_session") as get_http_session,
+			patch.object(connection.time, "sleep") as sleep,
+		):
+			request = get_http_session.return_value.request
+
+			request.side_effect = [_make_response(404)]
+			self.assertRaises(ResourceNotFound, api_connection._open, "GET", "/products/1.json")
+
+			# throttled request is retried after Retry-After seconds
+			request.side_effect = [_make_response(429, {"Retry-After": "1.5"}), _make_response(200)]
+			response = api_connection._open("GET", "/products/1.json")
+
+		self.assertEqual(response.code, 200)
+		self.assertEqual(request.call_count, 3)
+		sleep.assert_called_once_with(1.5)
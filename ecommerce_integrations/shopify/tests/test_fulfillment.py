@@ -0,0 +1,31 @@
+# Copyright (c) 2021, Frappe and Contributors
+# See LICENSE
+
+from frappe import _dict
+
+from ecommerce_integrations.shopify.fulfillment import get_fulfillment_items
+from ecommerce_integrations.shopify.tests.utils import TestCase
+
+
+class TestFulfillment(TestCase):
+	def test_get_fulfillment_items(self):
+		dn_items = [
+			_dict(item_code="_Test Item", qty=5),
+			_dict(item_code="_Test Item 2", qty=1),
+			_dict(item_code="_Test Item", qty=5),
+			_dict(item_code="_Test Item 3", qty=1),
+		]
+		fulfillment_items = [
+			{"product_id": 1, "variant_id": 11, "sku": "", "quantity": 2},
+			{"product_id": 1, "variant_id": 11, "sku": "", "quantity": 3},
+			{"product_id": 2, "variant_id": 21, "sku": "", "quantity": 1},
+		]
+		item_codes = {("1", "11", ""): "_Test Item", ("2", "21", ""): "_Test Item 2"}
+
+		items = get_fulfillment_items(dn_items, fulfillment_items, "62279942297", item_codes=item_codes)
+
+		# duplicate items are matched with fulfillment lines in order, unmatched items are dropped
+		self.assertEqual(
+			[(d.item_code, d.qty) for d in items], [("_Test Item", 2), ("_Test Item 2", 1), ("_Test Item", 3)]
+		)
+		self.assertEqual({d.warehouse for d in items}, {"_Test Warehouse 1 - _TC"})
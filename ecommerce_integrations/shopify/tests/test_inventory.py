@@ -0,0 +1,78 @@
+# Copyright (c) 2021, Frappe and Contributors
+# See LICENSE
+
+import unittest
+from unittest.mock import patch
+
+from frappe import _dict
+
+from ecommerce_integrations.shopify import inventory
+from ecommerce_integrations.shopify.inventory import InventorySyncLog, _update_status_from_user_errors
+
+
+class TestInventory(unittest.TestCase):
+	def test_user_errors_are_mapped_to_rows(self):
+		rows = [_dict(ecom_item=f"ecom-{i}", variant_id=str(i)) for i in range(4)]
+		user_errors = [
+			{"field": ["input", "quantities", "1", "quantity"], "message": "Quantity is too large"},
+			{
+				"code": "INVALID_LOCATION",
+				"field": ["input", "quantities", "3", "locationId"],
+				"message": "Location not found",
+			},
+		]
+
+		remaining_rows = _update_status_from_user_errors(rows, user_errors)
+
+		# rows without errors are resent as mutation is rejected entirely
+		self.assertEqual(remaining_rows, [rows[0], rows[2]])
+		self.assertEqual(rows[1].status, "Failed")
+		self.assertEqual(rows[1].failure_reason, "Quantity is too large")
+		self.assertEqual(rows[3].status, "Not Found")
+
+		self.assertEqual(_update_status_from_user_errors(remaining_rows, []), [])
+		self.assertEqual([d.status for d in remaining_rows], ["Success"] * 2)
+
+	def test_rejected_rows_are_not_resent(self):
+		rows = [_dict(ecom_item=f"ecom-{i}", variant_id=str(i), shopify_location_id="1") for i in range(3)]
+		responses = [
+			{
+				"inventorySetQuantities": {
+					"userErrors": [{"field": ["input", "quantities", "0"], "message": "Bad"}]
+				}
+			},
+			{"inventorySetQuantities": {"userErrors": []}},
+		]
+
+		with (
+			patch.object(inventory, "get_inventory_item_id", return_value="42"),
+			patch.object(inventory, "execute_graphql", side_effect=responses) as execute_graphql,
+		):
+			inventory._upload_inventory_batch_graphql(rows)
+
+		self.assertEqual(execute_graphql.call_count, 2)
+		self.assertEqual(len(execute_graphql.call_args.args[1]["input"]["quantities"]), 2)
+		self.assertEqual([d.status for d in rows], ["Failed", "Success", "Success"])
+
+	def test_batch_level_user_errors(self):
+		rows = [_dict(ecom_item="ecom-1", variant_id="1")]
+		user_errors = [{"field": ["input", "reason"], "message": "Invalid reason"}]
+
+		_update_status_from_user_errors(rows, user_errors)
+
+		self.assertEqual(rows[0].status, "Failed")
+		self.assertEqual(rows[0].failure_reason, "Invalid reason")
+
+	def test_inventory_sync_log_status(self):
+		sync_log = InventorySyncLog()
+		sync_log.add(
+			[
+				_dict(variant_id="1", shopify_location_id="L1", status="Success"),
+				_dict(variant_id="2", shopify_location_id="L1", status="Failed", failure_reason="Timeout"),
+			]
+		)
+
+		self.assertEqual(sync_log.get_status(), "Partial Success")
+		self.assertEqual(sync_log.get_summary()["failed"], 1)
+		self.assertIn("2,L1,Failed,Timeout", sync_log.get_message())
+		sync_log.close()
@@ -3,10 +3,31 @@
 
 import json
 import unittest
+from itertools import chain, repeat
+from unittest.mock import patch
 
+from ecommerce_integrations.shopify import order
 from ecommerce_integrations.shopify.order import sync_sales_order
 
 
 class TestOrder(unittest.TestCase):
 	def test_sync_with_variants(self):
 		pass
+
+	def test_queued_orders_are_left_for_next_run_after_time_limit(self):
+		redis = order.get_redis_conn()
+		key = order._get_order_batch_key()
+		redis.delete(key)
+		redis.rpush(key, "log-1", "log-2", "log-3")
+
+		# time limit is crossed while syncing second order
+		clock = chain([0, 1], repeat(order.ORDER_BATCH_TIME_LIMIT + 1))
+		with (
+			patch.object(order, "_sync_queued_order") as sync_queued_order,
+			patch.object(order.time, "monotonic", lambda: next(clock)),
+		):
+			order.sync_queued_orders()
+
+		self.assertEqual(sync_queued_order.call_count, 2)
+		self.assertEqual(redis.lrange(key, 0, -1), [b"log-3"])
+		redis.delete(key)
@@ -0,0 +1,47 @@
+# Copyright (c) 2021, Frappe and Contributors
+# See LICENSE
+
+import time
+import unittest
+
+from ecommerce_integrations.shopify.paginator import PagePrefetcher
+
+
+class TestPagePrefetcher(unittest.TestCase):
+	def test_pages_are_fetched_in_order(self):
+		def fetch_page(cursor):
+			return list(range(cursor, cursor + 3)), (cursor + 3 if cursor < 6 else None)
+
+		with PagePrefetcher(fetch_page, cursor=0) as pages:
+			self.assertEqual(list(pages), [[0, 1, 2], [3, 4, 5], [6, 7, 8]])
+
+	def test_fetch_errors_are_raised(self):
+		def fetch_page(cursor):
+			if cursor:
+				raise ValueError("Page not found")
+			return [1], 1
+
+		with PagePrefetcher(fetch_page) as pages:
+			iterator = iter(pages)
+			self.assertEqual(next(iterator), [1])
+			self.assertRaises(ValueError, next, iterator)
+
+	def test_fetching_stops_when_iteration_is_left(self):
+		fetched = []
+
+		def fetch_page(cursor):
+			fetched.append(cursor)
+			return [cursor], cursor + 1
+
+		with PagePrefetcher(fetch_page, cursor=0, buffer_size=2) as pages:
+			for page in pages:
+				if page == [5]:
+					break
+
+		time.sleep(1.5)
+		fetched_after_close = len(fetched)
+		time.sleep(1.5)
+
+		# only pages in buffer could be fetched ahead
+		self.assertLessEqual(fetched_after_close, 5 + 1 + 3)
+		self.assertEqual(len(fetched), fetched_after_close)
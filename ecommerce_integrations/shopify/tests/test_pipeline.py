@@ -0,0 +1,103 @@
+# Copyright (c) 2021, Frappe and Contributors
+# See LICENSE
+
+import json
+import time
+import unittest
+from unittest.mock import patch
+
+import frappe
+
+from ecommerce_integrations.controllers.scheduling import JobLease
+from ecommerce_integrations.shopify import pipeline
+from ecommerce_integrations.shopify.constants import ORDER_EVENTS_LEASE
+from ecommerce_integrations.shopify.utils import create_shopify_log
+
+
+def _fail(*args, **kwargs):
+	raise Exception("Payment account is not set")
+
+
+def _get_doc(doctype, *args, get_doc=frappe.get_doc, **kwargs):
+	# sales order isn't used by failing stage
+	if doctype == "Sales Order":
+		return frappe._dict(name=args[0])
+	return get_doc(doctype, *args, **kwargs)
+
+
+@patch.object(pipeline, "_enqueue")
+@patch.dict(pipeline.STAGE_HANDLERS, {"Payment Entry": _fail})
+class TestPipeline(unittest.TestCase):
+	def setUp(self):
+		self.order = {"id": frappe.generate_hash()}
+		self.log = create_shopify_log(status="Success", make_new=True)
+
+	def tearDown(self):
+		redis = pipeline.get_redis_conn()
+		redis.delete(pipeline._get_retries_key(), pipeline._get_pending_stages_key(self.order["id"]))
+
+	def run_stage(self, attempt):
+		with patch.object(frappe, "get_doc", _get_doc):
+			pipeline.run_order_stage(
+				"Payment Entry",
+				self.order,
+				"SO-1",
+				request_id=self.log.name,
+				attempt=attempt,
+				sales_invoice="SI-1",
+			)
+
+	def get_stage_status(self):
+		return json.loads(frappe.db.get_value(self.log.doctype, self.log.name, "stage_status"))
+
+	def test_failed_stage_is_retried_after_delay(self, enqueue):
+		self.run_stage(attempt=1)
+
+		enqueue.assert_not_called()
+		self.assertEqual(self.get_stage_status()["Payment Entry"]["status"], "Queued")
+
+		pipeline.enqueue_due_order_stages()
+		enqueue.assert_not_called()
+
+		with patch.object(pipeline.time, "time", return_value=time.time() + pipeline.RETRY_DELAY):
+			pipeline.enqueue_due_order_stages()
+
+		job = enqueue.call_args.args[0]
+		self.assertEqual((job["attempt"], job["sales_invoice"]), (2, "SI-1"))
+		self.assertEqual(
+			pipeline.get_pending_stages([self.order["id"]]), {self.order["id"]: {"Payment Entry"}}
+		)
+
+	def test_exhausted_stage_fails_log_and_is_retried_from_log(self, enqueue):
+		self.run_stage(attempt=pipeline.ORDER_STAGES["Payment Entry"]["max_attempts"])
+
+		self.assertEqual(frappe.db.get_value(self.log.doctype, self.log.name, "status"), "Error")
+		self.assertEqual(self.get_stage_status()["Payment Entry"]["status"], "Error")
+		self.assertEqual(pipeline.get_pending_stages([self.order["id"]]), {})
+
+		self.assertTrue(pipeline.retry_failed_stages(self.order, "SO-1", self.log.name))
+		job = enqueue.call_args.args[0]
+		self.assertEqual((job["stage"], job["attempt"], job["sales_invoice"]), ("Payment Entry", 1, "SI-1"))
+		self.assertFalse(pipeline.retry_failed_stages(self.order, "SO-1", self.log.name))
+
+	def test_stage_waits_for_order_lease(self, enqueue):
+		lease = JobLease(f"{ORDER_EVENTS_LEASE}:{self.order['id']}")
+		self.assertTrue(lease.acquire())
+		try:
+			self.run_stage(attempt=1)
+		finally:
+			lease.release()
+
+		self.assertEqual(
+			self.get_stage_status()["Payment Entry"],
+			{"status": "Queued", "attempt": 1, "kwargs": {"sales_invoice": "SI-1"}},
+		)
+		self.assertEqual(pipeline.get_redis_conn().zcard(pipeline._get_retries_key()), 1)
+
+	def test_stage_queue_falls_back_to_default(self, enqueue):
+		with patch.object(pipeline, "get_queues_timeout", return_value={"default": 300, "long": 1500}):
+			self.assertEqual(pipeline._get_stage_queue("Payment Entry"), pipeline.FALLBACK_QUEUE)
+
+		queues = {"default": 300, "shopify_payment_entry": 600}
+		with patch.object(pipeline, "get_queues_timeout", return_value=queues):
+			self.assertEqual(pipeline._get_stage_queue("Payment Entry"), "shopify_payment_entry")
@@ -0,0 +1,73 @@
+# Copyright (c) 2021, Frappe and Contributors
+# See LICENSE
+
+import unittest
+from unittest.mock import patch
+
+import frappe
+
+from ecommerce_integrations.shopify import reconciliation
+from ecommerce_integrations.shopify.constants import ORDER_STATUS_FIELD
+from ecommerce_integrations.shopify.reconciliation import get_missed_events
+
+
+class TestReconciliation(unittest.TestCase):
+	def setUp(self):
+		self.setting = frappe._dict(sync_sales_invoice=1, sync_delivery_note=1)
+
+	def get_missed_events(self, orders, sales_orders, synced_fulfillments=None, pending_stages=None):
+		with (
+			patch.object(reconciliation, "_get_sales_orders", return_value=sales_orders),
+			patch.object(reconciliation, "_get_synced_fulfillments", return_value=synced_fulfillments or {}),
+			patch.object(reconciliation, "get_pending_stages", return_value=pending_stages or {}),
+		):
+			return get_missed_events(orders, self.setting)
+
+	def test_missing_orders_are_created(self):
+		orders = [
+			{"id": frappe.generate_hash(), "financial_status": "paid"},
+			{"id": frappe.generate_hash(), "financial_status": "voided", "cancelled_at": "2021-04-15"},
+		]
+
+		events = get_missed_events(orders, self.setting)
+
+		# missing orders are created, cancelled ones are ignored
+		self.assertEqual(events, [(orders[0], "orders/create")])
+
+	def test_partial_fulfillments_are_compared_by_id(self):
+		order = {
+			"id": "1",
+			"fulfillment_status": "partial",
+			"fulfillments": [{"id": 11}, {"id": 12}],
+		}
+		sales_orders = {"1": frappe._dict(docstatus=1, per_billed=0)}
+
+		events = self.get_missed_events([order], sales_orders, synced_fulfillments={"1": {"11"}})
+		self.assertEqual(events, [(order, "orders/partially_fulfilled")])
+
+		# partially delivered order isn't resent once all its fulfillments have delivery notes
+		events = self.get_missed_events([order], sales_orders, synced_fulfillments={"1": {"11", "12"}})
+		self.assertEqual(events, [])
+
+	def test_paid_order_with_pending_invoice(self):
+		order = {"id": "1", "financial_status": "paid"}
+		sales_orders = {"1": frappe._dict(docstatus=1, per_billed=0)}
+
+		events = self.get_missed_events([order], sales_orders, pending_stages={"1": {"Sales Invoice"}})
+		self.assertEqual(events, [])
+
+		events = self.get_missed_events([order], sales_orders)
+		self.assertEqual(events, [(order, "orders/paid")])
+
+	def test_cancelled_orders(self):
+		order = {"id": "1", "financial_status": "refunded", "cancelled_at": "2021-04-15"}
+
+		sales_orders = {"1": frappe._dict({"docstatus": 1, ORDER_STATUS_FIELD: "paid"})}
+		self.assertEqual(self.get_missed_events([order], sales_orders), [(order, "orders/cancelled")])
+
+		sales_orders = {"1": frappe._dict({"docstatus": 1, ORDER_STATUS_FIELD: "refunded"})}
+		self.assertEqual(self.get_missed_events([order], sales_orders), [])
+
+		# cancelled sales orders aren't updated again
+		sales_orders = {"1": frappe._dict({"docstatus": 2, ORDER_STATUS_FIELD: "paid"})}
+		self.assertEqual(self.get_missed_events([order], sales_orders), [])
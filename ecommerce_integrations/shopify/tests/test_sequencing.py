@@ -0,0 +1,81 @@
+# Copyright (c) 2021, Frappe and Contributors
+# See LICENSE
+
+import json
+import time
+import unittest
+from unittest.mock import patch
+
+import frappe
+
+from ecommerce_integrations.shopify import sequencing
+from ecommerce_integrations.shopify.constants import EVENT_MAPPER
+
+
+@patch.object(sequencing, "enqueue_order_events")
+@patch.object(sequencing, "_mark_superseded")
+class TestSequencing(unittest.TestCase):
+	def setUp(self):
+		self.order_id = frappe.generate_hash()
+
+	def tearDown(self):
+		sequencing.get_redis_conn().delete(
+			sequencing._get_order_events_key(self.order_id),
+			sequencing._get_created_order_key(self.order_id),
+			sequencing._get_waiting_order_key(self.order_id),
+		)
+		sequencing.get_redis_conn().srem(sequencing._get_pending_orders_key(), self.order_id)
+
+	def queue(self, event, request_id, updated_at):
+		order = {"id": self.order_id, "updated_at": updated_at}
+		sequencing.queue_order_event(order, event, request_id)
+
+	def test_events_are_processed_in_sequence(self, mark_superseded, enqueue):
+		self.queue("orders/cancelled", "log-3", "2021-01-01T10:02:00")
+		self.queue("orders/paid", "log-2", "2021-01-01T10:01:00")
+		self.queue("orders/create", "log-1", "2021-01-01T10:00:00")
+
+		method, entry = sequencing._get_next_event(self.order_id)
+		self.assertEqual(method, EVENT_MAPPER["orders/create"])
+		self.assertEqual(json.loads(entry)["request_id"], "log-1")
+		mark_superseded.assert_not_called()
+
+	def test_newer_event_supersedes_pending_event(self, mark_superseded, enqueue):
+		self.queue("orders/fulfilled", "log-1", "2021-01-01T10:00:00")
+		self.queue("orders/partially_fulfilled", "log-2", "2021-01-01T10:05:00")
+		mark_superseded.assert_called_once_with("log-1")
+
+		# redelivery of older webhook doesn't replace newer one
+		self.queue("orders/fulfilled", "log-3", "2021-01-01T10:01:00")
+		mark_superseded.assert_called_with("log-3")
+
+		# sales order of the order was already created
+		sequencing._mark_order_created(self.order_id)
+		_, entry = sequencing._get_next_event(self.order_id)
+		self.assertEqual(json.loads(entry)["request_id"], "log-2")
+
+	def test_follow_up_event_waits_for_create_event(self, mark_superseded, enqueue):
+		# paid webhook is delivered before create webhook, without batch sync of new orders
+		self.queue("orders/paid", "log-2", "2021-01-01T10:01:00")
+		self.assertIsNone(sequencing._get_next_event(self.order_id))
+
+		self.queue("orders/create", "log-1", "2021-01-01T10:00:00")
+		method, _ = sequencing._get_next_event(self.order_id)
+		self.assertEqual(method, sequencing.CREATE_ORDER_METHOD)
+
+		sequencing.get_redis_conn().hdel(sequencing._get_order_events_key(self.order_id), method)
+		sequencing._mark_order_created(self.order_id)
+
+		method, entry = sequencing._get_next_event(self.order_id)
+		self.assertEqual(method, EVENT_MAPPER["orders/paid"])
+		self.assertEqual(json.loads(entry)["request_id"], "log-2")
+
+	def test_follow_up_event_is_released_after_timeout(self, mark_superseded, enqueue):
+		self.queue("orders/paid", "log-1", "2021-01-01T10:00:00")
+		self.assertIsNone(sequencing._get_next_event(self.order_id))
+
+		timeout = time.time() + sequencing.CREATE_EVENT_TIMEOUT + 1
+		with patch.object(sequencing.time, "time", return_value=timeout):
+			method, _ = sequencing._get_next_event(self.order_id)
+
+		self.assertEqual(method, EVENT_MAPPER["orders/paid"])